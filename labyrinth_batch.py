@@ -0,0 +1,274 @@
+import argparse, os, json, hashlib, time, traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from queue import Empty
+from typing import Dict, List
+
+from labyrinth_config import LabyrinthConfig
+
+
+def read_manifest(manifest_path: str) -> List[dict]:
+    # one job per line: {"config": name or dict, "seed": int, "outputs": [...]}
+    # optional keys: "id", "windows", "generator"
+    jobs = []
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            if line.strip():
+                jobs.append(normalize_job(json.loads(line)))
+    return jobs
+
+
+def normalize_job(job: dict) -> dict:
+    if isinstance(job["config"], str):
+        config_name = job["config"]
+        config = dict(getattr(LabyrinthConfig, config_name))
+    else:
+        config = {**LabyrinthConfig.default_config, **job["config"]}
+        config_name = job.get("config_name", "custom")
+    config["seed"] = job.get("seed", config["seed"])
+
+    job = {
+        "config_name": config_name,
+        "config": config,
+        "outputs": sorted(job.get("outputs", ["stl"])),
+        "windows": job.get("windows", True),
+        "generator": job.get("generator", "compat"),
+        "id": job.get("id"),
+    }
+    if job["id"] is None:
+        digest = hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()
+        job["id"] = f"{config_name}_s{config['seed']}_{digest[:10]}"
+    return job
+
+
+def graph_key(job: dict) -> tuple:
+    # jobs with the same key share one generated graph
+    config = job["config"]
+    return (config["cubeSize"], config["seed"], job["generator"])
+
+
+def read_finished(results_path: str) -> Dict[str, dict]:
+    finished = {}
+    if os.path.isfile(results_path):
+        with open(results_path) as results:
+            for line in results:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a crashed run may be cut off
+                    continue
+                if result.get("status") == "ok":
+                    finished[result["id"]] = result
+    return finished
+
+
+# per worker process: the artifact cache, created once by init_worker
+_worker_cache = None
+
+
+def init_worker(cache_path: str = None, cache_bytes: int = 2 * 1024**3):
+    global _worker_cache
+    from labyrinth_cache import ArtifactCache
+
+    if cache_path:
+        _worker_cache = ArtifactCache(cache_path, cache_bytes)
+
+
+def run_group(jobs: List[dict], output_path: str, validate: bool, results) -> int:
+    # runs in a worker process: all jobs of one graph key share one graph, the
+    # result of every job is put on the results queue as soon as it finishes
+    from main import create_graph
+
+    try:
+        cube_size, seed, generator = graph_key(jobs[0])
+        lgraph = create_graph({"cubeSize": cube_size, "seed": seed}, generator)
+    except Exception:
+        error = traceback.format_exc()
+        for job in jobs:
+            results.put(failed_result(job, error))
+        return 0
+    for job in jobs:
+        results.put(run_job(job, lgraph, output_path, validate))
+    return len(jobs)
+
+
+def failed_result(job: dict, error: str) -> dict:
+    return {
+        "id": job["id"],
+        "config_name": job["config_name"],
+        "seed": job["config"]["seed"],
+        "status": "error",
+        "error": error,
+    }
+
+
+def run_job(job: dict, lgraph, output_path: str, validate: bool = False) -> dict:
+    # runs in a worker process; with validate a job whose cube is not
+    # printable is marked invalid before rendering
+    from main import create_cube, create_outputs, needs_cube
+
+    start = time.perf_counter()
+    result = {"id": job["id"], "config_name": job["config_name"]}
+    result["seed"] = job["config"]["seed"]
+    cache = _worker_cache
+    cache_before = cache.stats if cache is not None else None
+    try:
+        job_path = os.path.join(output_path, job["id"])
+        os.makedirs(job_path, exist_ok=True)
+        lcube = None
+        if needs_cube(job["outputs"]):
+            lcube = create_cube(lgraph, job["config"], job["windows"])
+        problems = validate_cube(lcube, job["config"]) if validate else []
+        if problems:
+            result["status"] = "invalid"
+            result["problems"] = problems
+        else:
+            result["files"] = create_outputs(
+                lgraph,
+                lcube,
+                job["config"],
+                job["config_name"],
+                job_path,
+                job["outputs"],
+                {"maxWorkers": 1, "cache": cache},
+            )
+            if cache is not None:
+                # the worker cache counts over all its jobs
+                result["cache"] = {
+                    name: count - cache_before[name]
+                    for name, count in cache.stats.items()
+                }
+            result["status"] = "ok"
+    except Exception:
+        result["status"] = "error"
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def validate_cube(lcube, config: dict) -> List[str]:
+    # printability problems of the cube and its casing, see labyrinth_validate
+    if lcube is None:
+        return []
+    from labyrinth_casing import LabyrinthCasing
+    from labyrinth_validate import validateCube
+
+    lcase = LabyrinthCasing(
+        lcube, config["casingWallThickness"], config["casingTolerance"]
+    )
+    return validateCube(lcase)["problems"]
+
+
+def run_batch(
+    jobs: List[dict],
+    output_path: str,
+    results_path: str,
+    processes: int = None,
+    cache_path: str = None,
+    validate: bool = False,
+    cache_bytes: int = 2 * 1024**3,
+) -> int:
+    finished = read_finished(results_path)
+    pending = [job for job in jobs if job["id"] not in finished]
+    print(f"{len(finished)} jobs already finished, {len(pending)} jobs to run")
+    groups = {}
+    for job in pending:
+        groups.setdefault(graph_key(job), []).append(job)
+    # one task per graph, the largest groups first
+    groups = sorted(groups.values(), key=len, reverse=True)
+
+    failed = 0
+    remaining = {job["id"] for job in pending}
+
+    def write(result: dict):
+        nonlocal failed
+        remaining.discard(result["id"])
+        failed += result["status"] != "ok"
+        results.write(json.dumps(result) + "\n")
+        results.flush()
+        print(f"{result['status']:>5} {result['id']}")
+
+    pool = ProcessPoolExecutor(
+        processes, initializer=init_worker, initargs=(cache_path, cache_bytes)
+    )
+    with open(results_path, "a") as results, Manager() as manager, pool:
+        queue = manager.Queue()
+        futures = {
+            pool.submit(run_group, group, output_path, validate, queue): group
+            for group in groups
+        }
+        # every result is written as soon as its job finishes, so a crashed
+        # run only repeats the jobs that were still running
+        while remaining:
+            try:
+                write(queue.get(timeout=1))
+                continue
+            except Empty:
+                pass
+            # a finished task has put all its results, read them before the
+            # jobs its worker did not finish are written as errors
+            done = [future for future in futures if future.done()]
+            while True:
+                try:
+                    write(queue.get_nowait())
+                except Empty:
+                    break
+            for future in done:
+                group = futures.pop(future)
+                error = future.exception()
+                error = repr(error) if error else "the worker stopped early"
+                for job in group:
+                    if job["id"] in remaining:
+                        write(failed_result(job, error))
+    return failed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser("Generate many Labyrinth Cubes from a manifest")
+    parser.add_argument("manifest", help="json lines file with one job per line")
+    parser.add_argument("p", help="path for the job output directories")
+    parser.add_argument(
+        "--results",
+        help="json lines file for job results, finished jobs in it are skipped",
+        dest="results",
+    )
+    parser.add_argument(
+        "--processes", help="number of worker processes", dest="processes", type=int
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory of a cache for rendered .stl files shared by all jobs",
+        dest="cache",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="maximum size of the .stl cache in MB",
+        dest="cache_size",
+        type=float,
+    )
+    parser.add_argument(
+        "--validate",
+        help="skip jobs whose cube fails the printability check",
+        dest="validate",
+        action="store_true",
+    )
+    parser.set_defaults(results=None)
+    parser.set_defaults(cache=None)
+    parser.set_defaults(cache_size=2048)
+    parser.set_defaults(processes=None)
+
+    args = parser.parse_args()
+
+    os.makedirs(args.p, exist_ok=True)
+    results_path = args.results or os.path.join(args.p, "results.jsonl")
+    failed = run_batch(
+        read_manifest(args.manifest),
+        args.p,
+        results_path,
+        args.processes,
+        args.cache,
+        args.validate,
+        int(args.cache_size * 1024**2),
+    )
+    exit(1 if failed else 0)
@@ -0,0 +1,292 @@
+import argparse, json, multiprocessing, os, platform, resource, shutil, subprocess
+import sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from solid import scad_render
+
+from labyrinth_config import LabyrinthConfig
+from labyrinth_graph import LabyrinthGraph
+from labyrinth_render import renderStl
+
+CUBE_SIZES = [4, 9, 10, 20, 50]
+BENCHMARK_CONFIG = LabyrinthConfig.config01
+
+
+def createGraph(cubeSize: int) -> LabyrinthGraph:
+    lgraph = LabyrinthGraph(cubeSize)
+    lgraph.setRandomTree(BENCHMARK_CONFIG["seed"])
+    return lgraph
+
+
+def createCube(cubeSize: int):
+    lcube = createGraph(cubeSize).getLabyrinthCube(
+        BENCHMARK_CONFIG["levelWallThickness"],
+        BENCHMARK_CONFIG["levelPathThickness"],
+        BENCHMARK_CONFIG["levelSpacing"],
+    )
+    lcube.addAllWindows()
+    return lcube
+
+
+def createSolidCube(cubeSize: int):
+    lcube = createCube(cubeSize)
+    for level in lcube.levels:
+        level.getSolidLevel()
+    return lcube
+
+
+def createLevelScad(cubeSize: int, mode: str = "tree") -> tempfile.TemporaryDirectory:
+    # directory with level.scad, removed by measureStage after the run
+    directory = tempfile.TemporaryDirectory()
+    createCube(cubeSize).levels[0].createScadFile(
+        os.path.join(directory.name, "level"), mode
+    )
+    return directory
+
+
+def renderLevelScad(directory: tempfile.TemporaryDirectory):
+    renderStl(os.path.join(directory.name, "level"))
+
+
+# stage name: (setup, run), only run is timed; setup is called again for every
+# run, so memoized results (like level solids) are never reused
+STAGES = {
+    "setRandomTree": (lambda n: n, createGraph),
+    "findPath": (
+        createGraph,
+        lambda g: g.findPath(g.topCornerNode, g.bottomCornerNode),
+    ),
+    "getLabyrinthCube": (
+        createGraph,
+        lambda g: g.getLabyrinthCube(
+            BENCHMARK_CONFIG["levelWallThickness"],
+            BENCHMARK_CONFIG["levelPathThickness"],
+            BENCHMARK_CONFIG["levelSpacing"],
+        ),
+    ),
+    "getSolidLevel": (
+        createCube,
+        lambda lcube: [level.getSolidLevel() for level in lcube.levels],
+    ),
+    "scadRender": (
+        createSolidCube,
+        lambda lcube: [scad_render(level.getSolidLevel()) for level in lcube.levels],
+    ),
+    # a single level, rendering all of them would take hours for large cubes;
+    # openscadOutline renders the same level written with --scad outline
+    "openscad": (createLevelScad, renderLevelScad),
+    "openscadOutline": (lambda n: createLevelScad(n, "outline"), renderLevelScad),
+}
+
+
+# commands timed from interpreter start to exit by the "startup" stage, {path}
+# is replaced by a temporary output directory
+STARTUP_COMMANDS = {
+    "import": ["-c", "import main"],
+    "maze": ["-m", "main", "config01", "{path}", "--maze"],
+    "search": [
+        "-m",
+        "labyrinth_search",
+        "config01",
+        "--count",
+        "1",
+        "--processes",
+        "1",
+    ],
+    "vc": ["-m", "main", "config01", "{path}", "--vc"],
+}
+
+
+def getPeakBytes(usage=None) -> int:
+    peak = (usage or resource.getrusage(resource.RUSAGE_SELF)).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measureStage(stage: str, cubeSize: int, repeat: int, budget: float) -> dict:
+    # runs in a fresh process, so no other stage adds to the peak rss; it still
+    # includes the imports and the setup of the stage, not only the timed run;
+    # the time is the fastest of up to repeat runs within the time budget
+    setup, run = STAGES[stage]
+    times = []
+    while len(times) < repeat and sum(times) < budget:
+        argument = setup(cubeSize)
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+        if isinstance(argument, tempfile.TemporaryDirectory):
+            argument.cleanup()
+    return {"seconds": min(times), "runs": len(times), "peakBytes": getPeakBytes()}
+
+
+def measureStartup(command: List[str], repeat: int, budget: float) -> dict:
+    # every run starts a fresh interpreter, the peak rss is the one of that
+    # child process
+    times, peak = [], 0
+    with tempfile.TemporaryDirectory() as path:
+        arguments = [sys.executable] + [a.replace("{path}", path) for a in command]
+        while len(times) < repeat and sum(times) < budget:
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                arguments,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            _, status, usage = os.wait4(process.pid, 0)
+            times.append(time.perf_counter() - start)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            if process.returncode != 0:
+                raise RuntimeError(
+                    f"{' '.join(command)} exited with {process.returncode}"
+                )
+            peak = max(peak, getPeakBytes(usage))
+    return {"seconds": min(times), "runs": len(times), "peakBytes": peak}
+
+
+def runBenchmarks(
+    stages: List[str],
+    cubeSizes: List[int],
+    repeat: int = 5,
+    budget: float = 2.0,
+    openscadMaxSize: int = 10,
+) -> Dict[str, dict]:
+    # results keyed by "stage/cubeSize"
+    results = {}
+    hasOpenscad = shutil.which("openscad") is not None
+    context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        if stage == "startup":
+            for name, command in STARTUP_COMMANDS.items():
+                key = f"startup/{name}"
+                results[key] = measureStartup(command, repeat, budget)
+                printResult(key, results[key])
+            continue
+        for cubeSize in cubeSizes:
+            key = f"{stage}/{cubeSize}"
+            isOpenscad = stage.startswith("openscad")
+            if isOpenscad and not hasOpenscad:
+                results[key] = {"skipped": "openscad not found"}
+            elif isOpenscad and cubeSize > openscadMaxSize:
+                results[key] = {"skipped": f"cubeSize above {openscadMaxSize}"}
+            else:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    results[key] = executor.submit(
+                        measureStage, stage, cubeSize, repeat, budget
+                    ).result()
+            printResult(key, results[key])
+    return results
+
+
+def printResult(key: str, result: dict):
+    if "skipped" in result:
+        print(f"{key:<24} skipped, {result['skipped']}")
+    else:
+        print(
+            f"{key:<24} {result['seconds']:10.4f} s {result['runs']:3} runs "
+            f"{result['peakBytes'] / 1024**2:9.1f} MiB peak"
+        )
+
+
+def compareResults(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    threshold: float = 0.25,
+    minSeconds: float = 0.002,
+) -> List[str]:
+    # regressions beyond threshold (relative), differences below minSeconds
+    # are timer noise and ignored
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None or "skipped" in result or "skipped" in reference:
+            continue
+        seconds, referenceSeconds = result["seconds"], reference["seconds"]
+        if (
+            seconds > referenceSeconds * (1 + threshold)
+            and seconds - referenceSeconds > minSeconds
+        ):
+            regressions.append(
+                f"{key}: {referenceSeconds:.4f} s -> {seconds:.4f} s "
+                f"(+{seconds / referenceSeconds - 1:.0%})"
+            )
+        peak, referencePeak = result["peakBytes"], reference["peakBytes"]
+        if peak > referencePeak * (1 + threshold):
+            regressions.append(
+                f"{key}: {referencePeak / 1024**2:.1f} MiB -> "
+                f"{peak / 1024**2:.1f} MiB peak (+{peak / referencePeak - 1:.0%})"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser("Benchmark the Labyrinth Cube stages")
+    parser.add_argument("--sizes", help="cube sizes", dest="sizes", type=int, nargs="+")
+    parser.add_argument(
+        "--stages",
+        help="stages to run, startup times the cold start of main.py commands",
+        dest="stages",
+        nargs="+",
+        choices=list(STAGES) + ["startup"],
+    )
+    parser.add_argument(
+        "--repeat", help="maximum runs per stage", dest="repeat", type=int
+    )
+    parser.add_argument(
+        "--budget",
+        help="seconds after which a stage is not repeated anymore",
+        dest="budget",
+        type=float,
+    )
+    parser.add_argument(
+        "--openscad-max-size",
+        help="largest cube size rendered by openscad",
+        dest="openscad_max_size",
+        type=int,
+    )
+    parser.add_argument("--output", help="json file for the results", dest="output")
+    parser.add_argument(
+        "--baseline", help="json results to compare against", dest="baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        help="relative slowdown or memory growth that fails the comparison",
+        dest="threshold",
+        type=float,
+    )
+    parser.set_defaults(sizes=CUBE_SIZES)
+    parser.set_defaults(stages=list(STAGES) + ["startup"])
+    parser.set_defaults(repeat=5)
+    parser.set_defaults(budget=2.0)
+    parser.set_defaults(openscad_max_size=10)
+    parser.set_defaults(output=None)
+    parser.set_defaults(baseline=None)
+    parser.set_defaults(threshold=0.25)
+
+    args = parser.parse_args()
+
+    results = runBenchmarks(
+        args.stages, args.sizes, args.repeat, args.budget, args.openscad_max_size
+    )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                output,
+                indent=4,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compareResults(
+                results, json.load(baseline)["results"], args.threshold
+            )
+        for regression in regressions:
+            print(f"regression {regression}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        exit(1 if regressions else 0)
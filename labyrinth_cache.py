@@ -0,0 +1,83 @@
+import os, hashlib, shutil, fcntl, tempfile
+from contextlib import contextmanager
+
+
+def getCodeDigest(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, path: str, maxBytes: int = 2 * 1024**3):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def getEntryPath(self, key: str, extension: str = "stl") -> str:
+        return os.path.join(self.path, f"{key}.{extension}")
+
+    @contextmanager
+    def lock(self, key: str):
+        # held while a part is looked up and rendered, so concurrent runs that
+        # need the same part wait for the first render instead of repeating it
+        with open(self.getEntryPath(key, "lock"), "w") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def fetch(self, key: str, destination: str, extension: str = "stl") -> bool:
+        entryPath = self.getEntryPath(key, extension)
+        try:
+            shutil.copyfile(entryPath, destination)
+            # the modification time orders the entries for eviction
+            os.utime(entryPath)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key: str, source: str, extension: str = "stl"):
+        fd, temporaryPath = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(source, temporaryPath)
+        os.replace(temporaryPath, self.getEntryPath(key, extension))
+        self.evict()
+
+    def evict(self):
+        # another process may evict the same entries at the same time; the empty
+        # lock files stay, removing one could split the waiters of a render
+        # between the old and a new lock file
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith((".lock", ".tmp")):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        totalBytes = sum(size for _, size, _ in entries)
+        for _, size, entryPath in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(entryPath)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            totalBytes -= size
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def printStats(self):
+        print(
+            f"cache {self.path}: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions"
+        )
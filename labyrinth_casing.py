@@ -5,6 +5,8 @@ import numpy as np
 
 from labyrinth_cube import LabyrinthCube
 from labyrinth_level import LabyrinthLevel
+from labyrinth_cache import getCodeDigest
+from labyrinth_trace import traced
 
 
 class LabyrinthCasing:
@@ -115,15 +117,20 @@ class LabyrinthCasing:
         wcube = translate((center + outside) / 2)(cube(size, center=True))
         return wcube
 
-    def getCubeInCasingSolid(self) -> OpenSCADObject:
+    def getCubeInCasingSolid(self, instanced: bool = False) -> OpenSCADObject:
         casing = self.getReducedCasingSolid()
         lcube = translate(np.ones(3) * (self.casingThickness + self.tolerance))(
-            self.lc.getCubeSolid()
+            self.lc.getCubeSolid(instanced)
         )
         return casing + lcube
 
-    def createScadFile(self, name):
-        scad_render_to_file(self.getReducedCasingSolid(), f"{name}.scad")
+    @traced("createCasingScadFile")
+    def createScadFile(self, name) -> str:
+        # returns the digest of the scad code, used as artifact cache key
+        code = scad_render(self.getReducedCasingSolid())
+        with open(f"{name}.scad", "w") as scadFile:
+            scadFile.write(code)
+        return getCodeDigest(code)
 
 
 if __name__ == "__main__":
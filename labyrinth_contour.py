@@ -0,0 +1,113 @@
+from typing import List, Tuple
+import numpy as np
+
+# for every side of a cell: offset to the neighbor across it and the start and
+# end corner of the side, in counter clockwise order around the cell
+CELL_SIDES = [
+    ((0, -1), (0, 0), (1, 0)),
+    ((1, 0), (1, 0), (1, 1)),
+    ((0, 1), (1, 1), (0, 1)),
+    ((-1, 0), (0, 1), (0, 0)),
+]
+
+
+def getBoundaryEdges(mask: np.ndarray) -> np.ndarray:
+    # directed unit edges (x0, y0, x1, y1) on the lattice of cell corners between
+    # filled and empty cells, with the filled cell on the left
+    mask = mask.astype(bool)
+    padded = np.pad(mask, 1)
+    sizeX, sizeY = mask.shape
+    edges = []
+    for (dx, dy), (x0, y0), (x1, y1) in CELL_SIDES:
+        neighbor = padded[1 + dx : 1 + dx + sizeX, 1 + dy : 1 + dy + sizeY]
+        x, y = np.nonzero(mask & ~neighbor)
+        edges.append(np.stack([x + x0, y + y0, x + x1, y + y1], axis=1))
+    return np.concatenate(edges)
+
+
+def traceContours(mask: np.ndarray) -> List[np.ndarray]:
+    # closed loops of lattice points around the filled cells of a 2d mask, outer
+    # loops counter clockwise and holes clockwise, only corners are kept. Where
+    # two filled cells touch diagonally the loop turns left, so loops never
+    # cross and the mask is their even-odd fill.
+    edges = getBoundaryEdges(mask).tolist()
+    outgoing = {}
+    for edge, (x0, y0, _, _) in enumerate(edges):
+        outgoing.setdefault((x0, y0), []).append(edge)
+
+    def getTurn(edge: int, nextEdge: int) -> int:
+        # 0 for a left turn, 1 straight on, 2 for a right turn
+        x0, y0, x1, y1 = edges[edge]
+        nx0, ny0, nx1, ny1 = edges[nextEdge]
+        cross = (x1 - x0) * (ny1 - ny0) - (y1 - y0) * (nx1 - nx0)
+        return 1 - cross
+
+    isUsed = bytearray(len(edges))
+    loops = []
+    for first in range(len(edges)):
+        if isUsed[first]:
+            continue
+        points = []
+        edge = first
+        while not isUsed[edge]:
+            isUsed[edge] = 1
+            points.append(edges[edge][:2])
+            nextEdges = outgoing[tuple(edges[edge][2:])]
+            edge = min(nextEdges, key=lambda nextEdge: getTurn(edge, nextEdge))
+
+        points = np.array(points)
+        directions = np.roll(points, -1, axis=0) - points
+        isCorner = np.any(directions != np.roll(directions, 1, axis=0), axis=1)
+        loops.append(points[isCorner])
+    return loops
+
+
+def getContourPaths(
+    loops: List[np.ndarray], xEdges: np.ndarray, yEdges: np.ndarray
+) -> Tuple[List[List[float]], List[List[int]]]:
+    # points and paths of an openscad polygon, with the lattice points of the
+    # loops placed at the given cell edges
+    points, paths = [], []
+    for loop in loops:
+        paths.append(list(range(len(points), len(points) + len(loop))))
+        points += np.stack([xEdges[loop[:, 0]], yEdges[loop[:, 1]]], axis=1).tolist()
+    return points, paths
+
+
+def isInside(loops: List[np.ndarray], shape: Tuple[int, int]) -> np.ndarray:
+    # even-odd fill of the loops at the cell centers, the inverse of traceContours
+    x, y = np.meshgrid(
+        np.arange(shape[0]) + 0.5, np.arange(shape[1]) + 0.5, indexing="ij"
+    )
+    crossings = np.zeros(shape, dtype=int)
+    for loop in loops:
+        start, end = loop, np.roll(loop, -1, axis=0)
+        # vertical edges right of the cell center cross a ray towards +x
+        for (x0, y0), (x1, y1) in zip(start.tolist(), end.tolist()):
+            if x0 == x1:
+                crossings += (x < x0) & (y > min(y0, y1)) & (y < max(y0, y1))
+    return crossings % 2 == 1
+
+
+if __name__ == "__main__":
+
+    import time
+    from labyrinth_graph import LabyrinthGraph
+
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        mask = rng.random(rng.integers(1, 12, size=2)) < rng.random()
+        assert np.array_equal(isInside(traceContours(mask), mask.shape), mask)
+
+    lgraph = LabyrinthGraph(50)
+    lgraph.setRandomTree(8, generator="fast")
+    level = lgraph.getLabyrinthCube(1.2, 15, 17).levels[25]
+    for name, layer in zip(["path", "floor"], level.getCarvedGrids()):
+        start = time.perf_counter()
+        loops = traceContours(layer)
+        duration = time.perf_counter() - start
+        assert np.array_equal(isInside(loops, layer.shape), layer)
+        print(
+            f"{name} layer: {int(layer.sum())} cells, {len(loops)} loops with "
+            f"{sum(len(loop) for loop in loops)} corners in {duration * 1000:.1f} ms"
+        )
@@ -4,6 +4,8 @@ from solid.utils import *
 import numpy as np
 
 from labyrinth_level import LabyrinthLevel
+from labyrinth_cache import getCodeDigest
+from labyrinth_scad import getLevelInstance
 
 
 class LabyrinthCube:
@@ -23,10 +25,13 @@ class LabyrinthCube:
         for level in self.levels:
             level.hasWindows = True
 
-    def getCubeSolid(self) -> OpenSCADObject:
+    def getCubeSolid(self, instanced: bool = False) -> OpenSCADObject:
+        # instanced refers to the level modules of writeLevelModules
         solidCube = union()(
             [
-                translate([0, 0, i * self.spacing])(self.levels[i].getSolidLevel())
+                translate([0, 0, i * self.spacing])(
+                    getLevelInstance(i) if instanced else self.levels[i].getSolidLevel()
+                )
                 for i in range(len(self.levels))
             ]
         )
@@ -53,8 +58,12 @@ class LabyrinthCube:
             extrusion.add(translate((p1 + p2) / 2)(cube(size, center=True)))
         return extrusion
 
-    def createScadFile(self, name):
-        scad_render_to_file(self.getCubeSolid(), f"{name}.scad")
+    def createScadFile(self, name) -> str:
+        # returns the digest of the scad code, used as artifact cache key
+        code = scad_render(self.getCubeSolid())
+        with open(f"{name}.scad", "w") as scadFile:
+            scadFile.write(code)
+        return getCodeDigest(code)
 
 
 if __name__ == "__main__":
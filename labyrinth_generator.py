@@ -0,0 +1,397 @@
+from typing import Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import permutations
+import numpy as np
+
+from labyrinth_graph import CLOSE_OFFSETS, EDGE_STORAGE
+
+# every ordering of the six close directions, one is picked per visited cell
+DIRECTION_ORDERS = list(permutations(range(6)))
+
+
+def getPaddedOffsets(shape: Tuple[int, int, int]) -> np.ndarray:
+    # flat id offsets of the close directions in a grid with a one cell border
+    paddedShape = np.array(shape) + 2
+    strides = np.array([paddedShape[1] * paddedShape[2], paddedShape[2], 1])
+    return CLOSE_OFFSETS @ strides
+
+
+@lru_cache(maxsize=8)
+def getDirectionOrders(shape: Tuple[int, int, int]):
+    # (flat offset, direction code) of the close cells for every direction order,
+    # cached since building them dominates carving small cubes
+    offsets = getPaddedOffsets(shape)
+    return [
+        tuple((int(offsets[direction]), direction + 1) for direction in order)
+        for order in DIRECTION_ORDERS
+    ]
+
+
+def parentDirectionsToConnections(parentDirections: np.ndarray) -> np.ndarray:
+    # parentDirections holds direction + 1 of the step parent -> cell, anything
+    # else for cells without parent
+    connections = np.zeros((*parentDirections.shape, 3), dtype=bool)
+    for direction, (isParentEdge, axis) in enumerate(EDGE_STORAGE):
+        isChild = parentDirections == direction + 1
+        if isParentEdge:
+            # the edge is stored on the parent, one step against the direction
+            childSlices, parentSlices = [], []
+            for offset in CLOSE_OFFSETS[direction]:
+                childSlices.append(
+                    slice(max(offset, 0), None if offset >= 0 else offset)
+                )
+                parentSlices.append(
+                    slice(max(-offset, 0), None if offset <= 0 else -offset)
+                )
+            connections[(*parentSlices, axis)] |= isChild[tuple(childSlices)]
+        else:
+            connections[..., axis] |= isChild
+    return connections
+
+
+def carveRandomTree(
+    shape: Tuple[int, int, int], seed, start=None, blockSize: int = 1 << 16
+) -> np.ndarray:
+    # same randomized depth first carving as LabyrinthGraph.setRandomTree, but on
+    # a padded flat grid whose border is marked as visited, so no bounds checks
+    # are needed, and with the direction orders drawn in blocks
+    shape = tuple(int(s) for s in shape)
+    if start is None:
+        start = (0, 0, shape[2] - 1)
+    paddedShape = tuple(s + 2 for s in shape)
+
+    # a cell is visited once it holds the direction code it was reached with,
+    # the border and the start cell hold a code that is no direction
+    noDirection = len(CLOSE_OFFSETS) + 1
+    border = np.full(paddedShape, noDirection, dtype=np.uint8)
+    border[1:-1, 1:-1, 1:-1] = 0
+    parentDirections = bytearray(border.tobytes())
+
+    orders = getDirectionOrders(shape)
+
+    rng = np.random.default_rng(seed)
+    blockSize = min(blockSize, int(np.prod(shape)))
+    startId = int(np.ravel_multi_index(tuple(np.array(start) + 1), paddedShape))
+    parentDirections[startId] = noDirection
+    stack = [startId]
+    pop, push = stack.pop, stack.append
+    while stack:
+        for orderIndex in rng.integers(len(orders), size=blockSize).tolist():
+            currentId = pop()
+            for offset, code in orders[orderIndex]:
+                closeId = currentId + offset
+                if not parentDirections[closeId]:
+                    parentDirections[closeId] = code
+                    push(closeId)
+            if not stack:
+                break
+
+    parentDirections = np.frombuffer(parentDirections, dtype=np.uint8)
+    parentDirections = parentDirections.reshape(paddedShape)[1:-1, 1:-1, 1:-1]
+    return parentDirectionsToConnections(parentDirections)
+
+
+def getBlockSlices(
+    shape: Tuple[int, int, int], blockSize: int
+) -> List[Tuple[slice, slice, slice]]:
+    blockCounts = [-(-size // blockSize) for size in shape]
+    return [
+        tuple(slice(b * blockSize, (b + 1) * blockSize) for b in blockIndex)
+        for blockIndex in np.ndindex(*blockCounts)
+    ]
+
+
+def _carveBlock(arguments) -> np.ndarray:
+    blockShape, seed = arguments
+    return carveRandomTree(blockShape, seed)
+
+
+def getBoundaryEdges(shape: Tuple[int, int, int], blockSize: int, axis: int):
+    # cells storing the edges that cross block boundaries along axis, together
+    # with the blocks on both sides of each edge
+    blockCounts = np.array([-(-size // blockSize) for size in shape])
+    planes = np.arange(blockSize, shape[axis], blockSize)
+    grid = np.meshgrid(planes, *[np.arange(shape[a]) for a in range(3) if a != axis])
+    upper = [g.ravel() for g in grid]
+    upper.insert(axis, upper.pop(0))
+    lower = list(upper)
+    lower[axis] = upper[axis] - 1
+
+    def blockId(cells):
+        blockIndex = [c // blockSize for c in cells]
+        return np.ravel_multi_index(blockIndex, blockCounts)
+
+    # x and y edges are stored on the lower cell, z edges on the upper one
+    storage = upper if axis == 2 else lower
+    return np.stack(storage), blockId(lower), blockId(upper)
+
+
+def carveBlockTree(
+    shape: Tuple[int, int, int],
+    seed,
+    blockSize: int = 32,
+    processes: Optional[int] = None,
+) -> np.ndarray:
+    # carve a spanning tree in every block in parallel, then join the blocks with
+    # one random boundary edge per block tree edge (kruskal over the blocks)
+    shape = tuple(int(s) for s in shape)
+    blockSlices = getBlockSlices(shape, blockSize)
+    blockSeeds = np.random.SeedSequence(seed).spawn(len(blockSlices) + 1)
+    stitchRng = np.random.default_rng(blockSeeds.pop())
+
+    jobs = [
+        (tuple(len(range(*s.indices(size))) for s, size in zip(slices, shape)), bs)
+        for slices, bs in zip(blockSlices, blockSeeds)
+    ]
+    connections = np.zeros((*shape, 3), dtype=bool)
+    if len(jobs) == 1 or processes == 1:
+        blockConnections = list(map(_carveBlock, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            blockConnections = list(pool.map(_carveBlock, jobs))
+    for slices, blockConnection in zip(blockSlices, blockConnections):
+        connections[slices] = blockConnection
+
+    candidates = [getBoundaryEdges(shape, blockSize, axis) for axis in range(3)]
+    axes = np.concatenate([np.full(len(c[1]), a) for a, c in enumerate(candidates)])
+    cells = np.concatenate([c[0] for c in candidates], axis=1)
+    lowerBlocks = np.concatenate([c[1] for c in candidates])
+    upperBlocks = np.concatenate([c[2] for c in candidates])
+
+    # the first edge of a random order between two blocks is the only one
+    # kruskal could pick for that block pair
+    order = np.lexsort((stitchRng.random(len(axes)), upperBlocks, lowerBlocks))
+    pairs = lowerBlocks[order] * len(blockSlices) + upperBlocks[order]
+    firstOfPair = order[np.diff(pairs, prepend=-1) != 0]
+    firstOfPair = firstOfPair[stitchRng.permutation(len(firstOfPair))]
+
+    blockParents = list(range(len(blockSlices)))
+
+    def findRoot(block: int) -> int:
+        while blockParents[block] != block:
+            blockParents[block] = blockParents[blockParents[block]]
+            block = blockParents[block]
+        return block
+
+    for edge in firstOfPair.tolist():
+        lowerRoot = findRoot(int(lowerBlocks[edge]))
+        upperRoot = findRoot(int(upperBlocks[edge]))
+        if lowerRoot != upperRoot:
+            blockParents[upperRoot] = lowerRoot
+            connections[(*cells[:, edge], axes[edge])] = True
+
+    return connections
+
+
+def streamEllerLayers(
+    shape: Tuple[int, int, int],
+    seed,
+    joinProbability: float = 0.5,
+    downProbability: float = 0.3,
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    # eller's algorithm extended to 3d: the cube is swept from the top level
+    # down and only the sets of the cells in the current level are kept. Cells
+    # of a level are joined by random edges between different sets, every set
+    # continues in at least one cell of the level below, and the bottom level
+    # joins all remaining sets. Yields z, the (nx, ny, 3) connections and the
+    # rooms of every level as soon as the level is final.
+    nx, ny, nz = (int(s) for s in shape)
+    cellCount = nx * ny
+    rng = np.random.default_rng(seed)
+
+    # edges inside a level as pairs of flat cell ids, x edges first
+    cellIds = np.arange(cellCount).reshape(nx, ny)
+    edgeCells = np.concatenate(
+        [
+            np.stack([cellIds[:-1].ravel(), cellIds[1:].ravel()], axis=1),
+            np.stack([cellIds[:, :-1].ravel(), cellIds[:, 1:].ravel()], axis=1),
+        ]
+    )
+    edgeAxes = np.repeat([0, 1], [(nx - 1) * ny, nx * (ny - 1)])
+    edgeList = edgeCells.tolist()
+
+    def findRoot(parents: List[int], s: int) -> int:
+        while parents[s] != s:
+            parents[s] = parents[parents[s]]
+            s = parents[s]
+        return s
+
+    sets = np.arange(cellCount)
+    isFromAbove = np.zeros(cellCount, dtype=bool)
+    for z in range(nz - 1, -1, -1):
+        isBottom = z == 0
+        _, sets = np.unique(sets, return_inverse=True)
+        setParents = list(range(int(sets.max()) + 1))
+        cellSets = sets.tolist()
+
+        order = rng.permutation(len(edgeList))
+        if not isBottom:
+            order = order[rng.random(len(order)) < joinProbability]
+        isJoined = np.zeros(len(edgeList), dtype=bool)
+        for edge in order.tolist():
+            a, b = edgeList[edge]
+            rootA = findRoot(setParents, cellSets[a])
+            rootB = findRoot(setParents, cellSets[b])
+            if rootA != rootB:
+                setParents[rootB] = rootA
+                isJoined[edge] = True
+        roots = np.array([findRoot(setParents, s) for s in range(len(setParents))])
+        roots = roots[sets]
+
+        isDown = np.zeros(cellCount, dtype=bool)
+        if not isBottom:
+            draws = rng.random(cellCount)
+            isDown = draws < downProbability
+            # the cell with the lowest draw of every set goes down in any case
+            bySet = np.lexsort((draws, roots))
+            isDown[bySet[np.diff(roots[bySet], prepend=-1) != 0]] = True
+
+        layer = np.zeros((cellCount, 3), dtype=bool)
+        for axis in range(2):
+            layer[edgeCells[isJoined & (edgeAxes == axis), 0], axis] = True
+        layer[:, 2] = isDown
+        degrees = np.bincount(edgeCells[isJoined].ravel(), minlength=cellCount)
+        isRoom = (degrees > 0) | isDown | isFromAbove
+        yield z, layer.reshape(nx, ny, 3), isRoom.reshape(nx, ny)
+
+        # cells below a set keep it, all others start new sets
+        sets = np.where(isDown, roots, roots.max() + 1 + np.arange(cellCount))
+        isFromAbove = isDown
+
+
+@lru_cache(maxsize=8)
+def getEdgeList(shape: Tuple[int, int, int]):
+    # both cells of every edge of the grid and the index of the edge in the
+    # flattened connections; x and y edges are stored on the lower cell, z edges
+    # on the upper one
+    cellIds = np.arange(int(np.prod(shape))).reshape(shape)
+    lower = [cellIds[:-1], cellIds[:, :-1], cellIds[:, :, :-1]]
+    upper = [cellIds[1:], cellIds[:, 1:], cellIds[:, :, 1:]]
+    storage = [lower[0] * 3, lower[1] * 3 + 1, upper[2] * 3 + 2]
+    return tuple(
+        np.concatenate([e.ravel() for e in edges]) for edges in [lower, upper, storage]
+    )
+
+
+def carveMinimumTrees(shape: Tuple[int, int, int], weights: np.ndarray) -> np.ndarray:
+    # minimum spanning trees of the grid for a batch of edge weights (K, edges),
+    # returns connections (K, nx, ny, nz, 3). Boruvka runs on all mazes at once:
+    # every component picks its lightest outgoing edge, then the components
+    # that are joined by the picked edges merge, until no outgoing edge is left
+    shape = tuple(int(s) for s in shape)
+    lower, upper, storage = getEdgeList(shape)
+    mazeCount, edgeCount = weights.shape
+    cellCount = int(np.prod(shape))
+
+    # ranks instead of weights, so equal weights are ordered by the edge index
+    order = np.argsort(weights, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(edgeCount)[None], axis=1)
+
+    # cells and components of maze k are numbered from k * cellCount
+    offsets = np.arange(mazeCount)[:, None] * cellCount
+    lowerIds, upperIds = lower + offsets, upper + offsets
+    components = np.arange(mazeCount * cellCount)
+    isTree = np.zeros((mazeCount, edgeCount), dtype=bool)
+    while True:
+        lowerComponents, upperComponents = components[lowerIds], components[upperIds]
+        isOutgoing = lowerComponents != upperComponents
+        if not isOutgoing.any():
+            break
+        lightest = np.full(len(components), edgeCount)
+        outgoingRanks = ranks[isOutgoing]
+        np.minimum.at(lightest, lowerComponents[isOutgoing], outgoingRanks)
+        np.minimum.at(lightest, upperComponents[isOutgoing], outgoingRanks)
+
+        picking = np.flatnonzero(lightest < edgeCount)
+        mazes = picking // cellCount
+        edges = order[mazes, lightest[picking]]
+        isTree[mazes, edges] = True
+        ends = lowerComponents[mazes, edges], upperComponents[mazes, edges]
+        parents = np.arange(len(components))
+        parents[picking] = np.where(ends[0] == picking, ends[1], ends[0])
+        # two components that picked the same edge point at each other, the
+        # smaller one becomes the root
+        isMutual = (parents[parents[picking]] == picking) & (picking < parents[picking])
+        parents[picking[isMutual]] = picking[isMutual]
+        while True:
+            grandparents = parents[parents]
+            if np.array_equal(grandparents, parents):
+                break
+            parents = grandparents
+        components = parents[components]
+
+    connections = np.zeros((mazeCount, cellCount * 3), dtype=bool)
+    connections[:, storage] = isTree
+    return connections.reshape(mazeCount, *shape, 3)
+
+
+def getBoruvkaStream(seed, index: int = 0) -> np.random.SeedSequence:
+    # the index-th child of np.random.SeedSequence(seed).spawn
+    return np.random.SeedSequence(seed, spawn_key=(index,))
+
+
+def carveBoruvkaTrees(
+    shape: Tuple[int, int, int], streams: List[np.random.SeedSequence]
+) -> np.ndarray:
+    # one maze per seed sequence with uniformly random edge weights, e.g. for
+    # np.random.SeedSequence(seed).spawn(K); maze k is the same maze as
+    # setRandomTree(seed, "boruvka", index=k)
+    edgeCount = len(getEdgeList(tuple(int(s) for s in shape))[0])
+    weights = np.stack(
+        [np.random.default_rng(stream).random(edgeCount) for stream in streams]
+    )
+    return carveMinimumTrees(shape, weights)
+
+
+if __name__ == "__main__":
+
+    import time
+    from labyrinth_graph import LabyrinthGraph
+
+    def isSpanningTree(lgraph: LabyrinthGraph) -> bool:
+        edgeCount = int(lgraph.getLinkTable().sum()) // 2
+        return edgeCount == lgraph.cellCount - 1 and bool(lgraph.getRoomField().all())
+
+    def benchmark(cubeSize: int, generator: str):
+        lgraph = LabyrinthGraph(cubeSize)
+        startTime = time.perf_counter()
+        lgraph.setRandomTree(1, generator=generator)
+        duration = time.perf_counter() - startTime
+        print(
+            f"{generator:>8} cubeSize {cubeSize:>4}: {duration:8.3f} s, "
+            f"{lgraph.cellCount / duration / 1e6:6.2f} M cells/s, "
+            f"spanning tree: {isSpanningTree(lgraph)}"
+        )
+
+    for cubeSize in [10, 50, 100]:
+        benchmark(cubeSize, "compat")
+    for cubeSize in [10, 50, 100, 200]:
+        benchmark(cubeSize, "fast")
+    for cubeSize in [100, 200]:
+        benchmark(cubeSize, "parallel")
+    for cubeSize in [10, 50, 100, 200]:
+        benchmark(cubeSize, "eller")
+    for cubeSize in [10, 50]:
+        benchmark(cubeSize, "boruvka")
+
+    # thousands of small mazes, one at a time and in one batched pass
+    mazeCount = 2000
+    startTime = time.perf_counter()
+    for index in range(mazeCount):
+        lgraph = LabyrinthGraph(4)
+        lgraph.setRandomTree(index, generator="fast")
+    loopDuration = time.perf_counter() - startTime
+    startTime = time.perf_counter()
+    batch = carveBoruvkaTrees((4, 4, 4), np.random.SeedSequence(1).spawn(mazeCount))
+    batchDuration = time.perf_counter() - startTime
+    print(
+        f"{mazeCount} mazes of cubeSize 4: {loopDuration:.3f} s one by one (fast), "
+        f"{batchDuration:.3f} s batched (boruvka)"
+    )
+    for index in [0, mazeCount - 1]:
+        lgraph = LabyrinthGraph(4)
+        lgraph.setRandomTree(1, generator="boruvka", index=index)
+        assert np.array_equal(lgraph.connections, batch[index])
+    assert all(isSpanningTree(LabyrinthGraph.fromConnections(c)) for c in batch)
@@ -1,10 +1,54 @@
-from typing import List
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
 import numpy as np
-from solid import scad_render_to_file
-from collections import deque
 
-from labyrinth_level import LabyrinthLevel
-from labyrinth_cube import LabyrinthCube
+from labyrinth_trace import traced
+
+# the geometry modules import solidpython, they are only loaded once levels
+# are built, so mazes can be generated and solved without it
+if TYPE_CHECKING:
+    from labyrinth_level import LabyrinthLevel
+    from labyrinth_storage import MazeRecord
+
+# offsets to the six close nodes in the order +x, +y, +z, -x, -y, -z
+CLOSE_OFFSETS = np.array(
+    [[1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]], dtype=int
+)
+
+# order of the close directions in LGraphNode.neighbors:
+# own connections (x+, y+, z-) first, then the reversed ones (x-, y-, z+)
+NEIGHBOR_DIRECTIONS = [0, 1, 5, 3, 4, 2]
+
+# for each close direction: is the edge stored on the cell itself (or on the
+# close cell) and in which entry of the connections
+EDGE_STORAGE = [(True, 0), (True, 1), (False, 2), (False, 0), (False, 1), (True, 2)]
+
+
+# bumped whenever a generator produces different mazes for the same seed
+GENERATOR_VERSIONS = {"compat": 1, "fast": 1, "parallel": 1, "eller": 1, "boruvka": 1}
+
+# options of each generator that change the maze, with their defaults; they are
+# saved with the maze so that it can be generated again
+GENERATOR_OPTIONS = {
+    "compat": {},
+    "fast": {},
+    "parallel": {"blockSize": 32},
+    "eller": {"joinProbability": 0.5, "downProbability": 0.3},
+    "boruvka": {"index": 0},
+}
+# options that only change how the maze is generated, not the maze
+GENERATOR_RUNTIME_OPTIONS = {"parallel": ["processes"]}
+
+
+def _closeTable(shape: Tuple[int, int, int]) -> np.ndarray:
+    cellIds = np.arange(int(np.prod(shape)), dtype=np.int32).reshape(shape)
+    table = np.full((*shape, 6), -1, dtype=np.int32)
+    table[:-1, :, :, 0] = cellIds[1:, :, :]
+    table[:, :-1, :, 1] = cellIds[:, 1:, :]
+    table[:, :, :-1, 2] = cellIds[:, :, 1:]
+    table[1:, :, :, 3] = cellIds[:-1, :, :]
+    table[:, 1:, :, 4] = cellIds[:, :-1, :]
+    table[:, :, 1:, 5] = cellIds[:, :, :-1]
+    return table.reshape(-1, 6)
 
 
 class LGraphNode:
@@ -20,80 +64,243 @@ class LGraphNode:
                 f"Other has type {type(other)}, only LGraphNode is supported"
             )
 
+    def __repr__(self) -> str:
+        return f"LGraphNode({self.location.tolist()})"
+
+    @property
+    def cellId(self) -> int:
+        return int(np.ravel_multi_index(self.location, self._connections.shape[:3]))
+
     @property
     def isValid(self):
-        overLowerBound = np.all(self.location >= np.zeros(3))
+        overLowerBound = np.all(self.location >= 0)
         underUpperBound = np.all(self.location < self._connections.shape[:3])
         return overLowerBound and underUpperBound
 
     @property
     def closeNodes(self) -> List["LGraphNode"]:
-        nodes = []
-        for i in range(6):
-            offset = np.zeros(3)
-            offset[i % 3] = 1 if i < 3 else -1
-            closeNode = LGraphNode(self.location + offset, self._connections)
-            if closeNode.isValid:
-                nodes.append(closeNode)
-        return nodes
+        return [
+            LGraphNode(location, self._connections)
+            for location in self.location + CLOSE_OFFSETS
+            if np.all(location >= 0) and np.all(location < self._connections.shape[:3])
+        ]
 
     @property
     def linkedNeighbors(self) -> List["LGraphNode"]:
-        neighbors = []
-        for i, isNeighbor in enumerate(
-            self._connections[tuple(self.location.astype(int))]
-        ):
-            if isNeighbor:
-                offset = np.zeros(3)
-                # connections on each level are in negative z direction
-                offset[i] = -1 if i == 2 else 1
-                neighborLocation = self.location + offset
-                neighbors.append(LGraphNode(neighborLocation, self._connections))
-        return neighbors
+        isLinked = self._connections[tuple(self.location)]
+        # connections on each level are in negative z direction
+        return [
+            LGraphNode(self.location + CLOSE_OFFSETS[direction], self._connections)
+            for i, direction in enumerate(NEIGHBOR_DIRECTIONS[:3])
+            if isLinked[i]
+        ]
 
     @property
     def neighbors(self) -> List["LGraphNode"]:
         neighbors = self.linkedNeighbors
-        for i in range(3):
-            offset = np.zeros(3)
-            # connections on each level are in negative z direction (this is reversed)
-            offset[i] = -1 if i == 2 else 1
-            neighborLocation = self.location - offset
-            neighbor = LGraphNode(neighborLocation, self._connections)
-            if neighbor.isValid and self in neighbor.linkedNeighbors:
-                neighbors.append(neighbor)
+        for i, direction in enumerate(NEIGHBOR_DIRECTIONS[3:]):
+            neighborLocation = self.location + CLOSE_OFFSETS[direction]
+            if np.all(neighborLocation >= 0) and np.all(
+                neighborLocation < self._connections.shape[:3]
+            ):
+                # the reversed connection is stored on the neighbor
+                if self._connections[(*neighborLocation, i)]:
+                    neighbors.append(LGraphNode(neighborLocation, self._connections))
         return neighbors
 
 
+def getLevelRoomField(
+    levelConnections: np.ndarray,
+    aboveConnections: Optional[np.ndarray] = None,
+    isBottom: bool = False,
+) -> np.ndarray:
+    # getRoomField for the (n, n, 3) connections of one level; the link to the
+    # level above is stored on the level above
+    c = levelConnections
+    isRoom = np.zeros(c.shape[:2], dtype=bool)
+    isRoom[:-1] |= c[:-1, :, 0]
+    isRoom[1:] |= c[:-1, :, 0]
+    isRoom[:, :-1] |= c[:, :-1, 1]
+    isRoom[:, 1:] |= c[:, :-1, 1]
+    if not isBottom:
+        isRoom |= c[:, :, 2]
+    if aboveConnections is not None:
+        isRoom |= aboveConnections[:, :, 2]
+    return isRoom
+
+
 class LabyrinthGraph:
     def __init__(self, cubeSize: int):
-        self.connections = np.zeros((cubeSize, cubeSize, cubeSize, 3), dtype=bool)
+        self._connections = np.zeros((cubeSize, cubeSize, cubeSize, 3), dtype=bool)
+        # a loaded maze record (see fromRecord), unpacked on demand
+        self.record: Optional["MazeRecord"] = None
+        # how the maze was generated, stored with saved mazes
+        self.seed = None
+        self.generator = ""
+        self.generatorOptions = {}
+
+    @classmethod
+    def fromConnections(cls, connections: np.ndarray) -> "LabyrinthGraph":
+        lgraph = cls(0)
+        lgraph.connections = connections
+        return lgraph
+
+    @classmethod
+    def fromRecord(cls, record: "MazeRecord") -> "LabyrinthGraph":
+        # nodes and levels are read from the packed record, the whole cube is
+        # only unpacked when connections is used
+        lgraph = cls(0)
+        lgraph._connections, lgraph.record = None, record
+        lgraph.seed, lgraph.generator = record.seed, record.generator
+        lgraph.generatorOptions = dict(record.options)
+        return lgraph
+
+    @classmethod
+    def load(cls, path: str, index: int = 0) -> "LabyrinthGraph":
+        from labyrinth_storage import readMaze
+
+        return readMaze(path, index).getGraph()
+
+    def save(self, path: str, append: bool = False):
+        from labyrinth_storage import writeMaze
+
+        writeMaze(
+            path,
+            self.connections,
+            self.seed,
+            self.generator,
+            GENERATOR_VERSIONS.get(self.generator, 0),
+            append,
+            self.generatorOptions,
+        )
+
+    @property
+    def connections(self) -> np.ndarray:
+        if self._connections is None:
+            self._connections = self.record.getConnections()
+        return self._connections
+
+    @connections.setter
+    def connections(self, connections: np.ndarray):
+        self._connections = connections
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        # cells along x, y and z, without unpacking a loaded record
+        if self._connections is None:
+            return (self.record.cubeSize,) * 3
+        return self._connections.shape[:3]
+
+    @property
+    def cubeSize(self) -> int:
+        return self.shape[0]
+
+    @property
+    def cellCount(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def cellStrides(self) -> np.ndarray:
+        # difference in flat cell id for a step along x, y and z
+        _, sizeY, sizeZ = self.shape
+        return np.array([sizeY * sizeZ, sizeZ, 1], dtype=np.int64)
+
+    @property
+    def closeOffsets(self) -> np.ndarray:
+        # difference in flat cell id to the six close cells, for linked cells
+        # the id of the neighbor is the cell id plus its offset
+        return (CLOSE_OFFSETS @ self.cellStrides).astype(np.int32)
 
     def getNode(self, location: np.ndarray):
-        return LGraphNode(location, self.connections)
+        if self._connections is None:
+            return LGraphNode(location, self.record)
+        return LGraphNode(location, self._connections)
+
+    def getCellId(self, location) -> int:
+        return int(np.ravel_multi_index(tuple(location), self.shape))
+
+    def getCellLocation(self, cellId: int) -> np.ndarray:
+        return np.array(np.unravel_index(cellId, self.shape))
+
+    def getNodeById(self, cellId: int) -> LGraphNode:
+        return self.getNode(self.getCellLocation(cellId))
+
+    def getLevelConnections(self, z: int) -> np.ndarray:
+        # (n, n, 3) connections of level z
+        if self._connections is None:
+            return self.record.getLevelConnections(z)
+        return self._connections[:, :, z, :]
+
+    def getCloseTable(self) -> np.ndarray:
+        # (cellCount, 6) ids of the close cells in CLOSE_OFFSETS order, -1 outside;
+        # 24 bytes per cell and built on every call, the searches step with
+        # closeOffsets instead
+        return _closeTable(tuple(self.shape))
+
+    def getLinkTable(self) -> np.ndarray:
+        # (cellCount, 6) flags telling whether the close cell is connected
+        c = self.connections
+        link = np.zeros((*c.shape[:3], 6), dtype=bool)
+        link[:-1, :, :, 0] = c[:-1, :, :, 0]
+        link[:, :-1, :, 1] = c[:, :-1, :, 1]
+        link[:, :, :-1, 2] = c[:, :, 1:, 2]
+        link[1:, :, :, 3] = c[:-1, :, :, 0]
+        link[:, 1:, :, 4] = c[:, :-1, :, 1]
+        link[:, :, 1:, 5] = c[:, :, 1:, 2]
+        return link.reshape(-1, 6)
+
+    def getAdjacency(self) -> Tuple[np.ndarray, np.ndarray]:
+        # CSR neighbor lists: neighbors of cell i are indices[indptr[i]:indptr[i+1]]
+        # listed in the same order as LGraphNode.neighbors
+        link = self.getLinkTable()[:, NEIGHBOR_DIRECTIONS]
+        indptr = np.zeros(self.cellCount + 1, dtype=np.int64)
+        np.cumsum(link.sum(axis=1), out=indptr[1:])
+        cellIds, directions = np.nonzero(link)
+        offsets = self.closeOffsets[NEIGHBOR_DIRECTIONS]
+        return indptr, (cellIds + offsets[directions]).astype(np.int32)
 
     @property
     def topCornerNode(self) -> LGraphNode:
-        return self.getNode([0, 0, self.connections.shape[2] - 1])
+        return self.getNode([0, 0, self.shape[2] - 1])
 
     @property
     def bottomCornerNode(self) -> LGraphNode:
-        return self.getNode([*self.connections.shape[:2] - np.ones(2), 0])
+        return self.getNode([*self.shape[:2] - np.ones(2), 0])
 
-    def getLabyrinthCube(self, wallThickness, pathThickness, spacing):
-        levels = []
-        for k in range(self.connections.shape[2]):  # z
+    def getDegreeField(self) -> np.ndarray:
+        # number of linked neighbors for every cell, shape (n, n, n)
+        return self.getLinkTable().sum(axis=1).reshape(self.shape)
 
-            isRoom = np.zeros(self.connections.shape[:2])
+    def getRoomField(self) -> np.ndarray:
+        # cells that are part of the labyrinth, i.e. have at least one neighbor
+        return self.getDegreeField() > 0
 
-            for i in range(self.connections.shape[0]):  # x
-                for j in range(self.connections.shape[1]):  # y
-                    isRoom[i, j] = len(self.getNode(np.array([i, j, k])).neighbors) > 0
+    @traced("getLabyrinthCube")
+    def getLabyrinthCube(self, wallThickness, pathThickness, spacing):
+        from labyrinth_level import LabyrinthLevel
+        from labyrinth_cube import LabyrinthCube
+
+        levelCount = self.shape[2]
+        if self._connections is None:
+            # a loaded record is unpacked one level at a time
+            roomFields = []
+            above = self.getLevelConnections(0)
+            for k in range(levelCount):
+                current = above
+                above = self.getLevelConnections(k + 1) if k + 1 < levelCount else None
+                roomFields.append(getLevelRoomField(current, above, k == 0))
+            roomField = np.stack(roomFields, axis=2).astype(float)
+        else:
+            roomField = self.getRoomField().astype(float)
 
+        levels = []
+        for k in range(levelCount):  # z
             level = LabyrinthLevel(
-                wallThickness, pathThickness, self.connections[:, :, k, :], isRoom
+                wallThickness,
+                pathThickness,
+                self.getLevelConnections(k),
+                roomField[:, :, k],
             )
-
             levels.append(level)
 
         return LabyrinthCube(levels, spacing)
@@ -118,11 +325,15 @@ class LabyrinthGraph:
         else:
             return False
 
-    def cutList(self, list, maxLength: int):
-        return list[: max(len(list), maxLength)]
-
-    def keepDirection(self, list, prevNode):
-        pass
+    def addEdgeById(self, cellId: int, direction: int):
+        # direction indexes CLOSE_OFFSETS, the edge is stored on the cell that owns it
+        closeLocation = self.getCellLocation(cellId) + CLOSE_OFFSETS[direction]
+        if np.any(closeLocation < 0) or np.any(closeLocation >= self.shape):
+            return False
+        closeId = cellId + int(self.closeOffsets[direction])
+        isOwnEdge, axis = EDGE_STORAGE[direction]
+        self.connections.reshape(-1, 3)[cellId if isOwnEdge else closeId, axis] = True
+        return True
 
     def prioritizeXY(self, nodes: List[LGraphNode], prevNode: LGraphNode):
         def priority(node: LGraphNode):
@@ -134,62 +345,131 @@ class LabyrinthGraph:
 
         return sorted(nodes, key=priority)
 
-    def randomShuffleList(self, nodes: List, randomState):
-        adjNodes = np.array(nodes)
-        perm = randomState.permutation(len(adjNodes))
-        permAdjNodes = adjNodes[perm]
-        return permAdjNodes
+    @traced("setRandomTree")
+    def setRandomTree(self, seed, generator: str = "compat", **options):
+        # "compat" reproduces the mazes of earlier versions for a given seed,
+        # "fast" runs the same carving with block drawn random numbers,
+        # "parallel" carves blocks of the cube in a process pool and joins them,
+        # "eller" sweeps the cube level by level (see streamLabyrinthLevels),
+        # "boruvka" is a minimum spanning tree of random edge weights, index
+        # selects a maze of a batch from carveBoruvkaTrees
+        if generator not in GENERATOR_VERSIONS:
+            raise ValueError(f"Unknown generator {generator}")
+        unused = set(options).difference(
+            GENERATOR_OPTIONS[generator], GENERATOR_RUNTIME_OPTIONS.get(generator, [])
+        )
+        if unused:
+            raise ValueError(
+                f"Generator {generator} does not take {', '.join(sorted(unused))}"
+            )
+        self.seed, self.generator = seed, generator
+        self.generatorOptions = {
+            name: options.get(name, default)
+            for name, default in GENERATOR_OPTIONS[generator].items()
+        }
 
-    def setRandomTree(self, seed):
-        rs = np.random.RandomState(seed=seed)
-        visited = np.zeros(self.connections.shape[:3], dtype=bool)
-        startNode = self.topCornerNode
-        visited[tuple(startNode.location)] = True
-        stack = [startNode]
-        while stack:
-            currentNode = stack.pop()
-            adjNodes = currentNode.closeNodes
+        if generator == "fast":
+            from labyrinth_generator import carveRandomTree
 
-            modifiedList = self.cutList(
-                self.randomShuffleList(adjNodes, rs), rs.random_sample([0, 0, 1])
+            self.connections |= carveRandomTree(
+                self.shape, seed, start=self.topCornerNode.location
             )
+            return
+        elif generator == "parallel":
+            from labyrinth_generator import carveBlockTree
+
+            self.connections |= carveBlockTree(self.shape, seed, **options)
+            return
+        elif generator == "eller":
+            from labyrinth_generator import streamEllerLayers
+
+            for z, layer, _ in streamEllerLayers(self.shape, seed, **options):
+                self.connections[:, :, z] = layer
+            return
+        elif generator == "boruvka":
+            from labyrinth_generator import carveBoruvkaTrees, getBoruvkaStream
+
+            streams = [getBoruvkaStream(seed, **options)]
+            trees = carveBoruvkaTrees(self.shape, streams)
+            self.connections |= trees[0]
+            return
 
-            for node in modifiedList:
-                if not visited[tuple(node.location)]:
-                    self.addEdge(currentNode, node)
-                    visited[tuple(node.location)] = True
-                    stack.append(node)
-
+        rs = np.random.RandomState(seed=seed)
+        closeTable = self.getCloseTable().tolist()
+        flatConnections = self.connections.reshape(-1, 3)
+        visited = [False] * self.cellCount
+        startId = self.topCornerNode.cellId
+        visited[startId] = True
+        stack = [startId]
+        while stack:
+            currentId = stack.pop()
+            adjIds = [
+                (direction, closeId)
+                for direction, closeId in enumerate(closeTable[currentId])
+                if closeId >= 0
+            ]
+
+            for index in rs.permutation(len(adjIds)).tolist():
+                direction, closeId = adjIds[index]
+                if not visited[closeId]:
+                    isOwnEdge, axis = EDGE_STORAGE[direction]
+                    flatConnections[currentId if isOwnEdge else closeId, axis] = True
+                    visited[closeId] = True
+                    stack.append(closeId)
+
+    def getDistanceField(
+        self, sourceNodes: List[LGraphNode], goalNode: Optional[LGraphNode] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # int32 distance and parent id fields of shape (n, n, n), -1 where not
+        # reached; with a goal node the search stops once the goal is reached
+        from labyrinth_solver import getDistanceField
+
+        distances, parents = getDistanceField(
+            self.getLinkTable(),
+            self.closeOffsets,
+            [node.cellId for node in sourceNodes],
+            None if goalNode is None else goalNode.cellId,
+        )
+        shape = self.shape
+        return distances.reshape(shape), parents.reshape(shape)
+
+    @traced("findPath")
     def findPath(self, startNode: LGraphNode, goalNode: LGraphNode):
-        prev = np.ones((*self.connections.shape[:3], 3), dtype=int) * -10000
-
-        def retrievePath(location: np.ndarray):
-            path = [location]
-            currentLocation = location
-            while True:
-                nextLocation = prev[tuple(currentLocation)]
-                path.append(nextLocation)
-                currentLocation = nextLocation
-                if self.getNode(nextLocation) == startNode:
-                    return list(reversed(path))
-
-        queue = deque()
-        queue.append(startNode)
-        prev[tuple(startNode.location)] = startNode.location
-        while queue:
-            currNode: LGraphNode = queue.popleft()
-            for node in currNode.neighbors:
-                if prev[tuple(node.location)][0] < 0:
-                    queue.append(node)
-                    prev[tuple(node.location)] = currNode.location
-                    if goalNode == node:
-                        path = retrievePath(goalNode.location)
-                        return path
+        from labyrinth_solver import getPathFromParents
+
+        # like the queue search this replaced, a start equal to the goal has no path
+        if startNode.cellId == goalNode.cellId:
+            return None
+        _, parents = self.getDistanceField([startNode], goalNode)
+        path = getPathFromParents(parents.ravel(), goalNode.cellId)
+        if path is not None:
+            return [self.getCellLocation(cellId) for cellId in path]
+
+
+def streamLabyrinthLevels(
+    cubeSize: int,
+    seed,
+    wallThickness,
+    pathThickness,
+    hasWindows: bool = False,
+    **options,
+) -> Iterator[Tuple[int, "LabyrinthLevel"]]:
+    # levels of the maze that setRandomTree(seed, "eller") creates, top level
+    # first; only one level is held in memory at a time
+    from labyrinth_generator import streamEllerLayers
+    from labyrinth_level import LabyrinthLevel
+
+    for z, isConnected, isRoom in streamEllerLayers((cubeSize,) * 3, seed, **options):
+        level = LabyrinthLevel(
+            wallThickness, pathThickness, isConnected, isRoom.astype(float), hasWindows
+        )
+        yield z, level
 
 
 if __name__ == "__main__":
 
     from copy import deepcopy
+    from solid import scad_render_to_file
 
     def testAddEdge():
         print("test add edge")
@@ -3,6 +3,9 @@ import numpy as np
 from solid import *
 from solid.utils import *
 
+from labyrinth_cache import getCodeDigest
+from labyrinth_trace import traced
+
 
 class ConnectionDirection:
     x_positive = 0
@@ -20,6 +23,7 @@ class LabyrinthLevel:
         self.isRoom = isRoom
         self.hasWindows = hasWindows
         self.eps = 0.00001
+        self._solidCache = {}
 
     @property
     def gridSize(self) -> int:
@@ -50,6 +54,33 @@ class LabyrinthLevel:
     def connectionSizeY(self) -> np.ndarray:
         return np.array([self.pathThickness, self.wallThickness + 2 * self.eps])
 
+    def getSlabEdges(self) -> np.ndarray:
+        # boundaries of the alternating wall and path slabs along x and y,
+        # slab 2i+1 holds room i, the even slabs are walls
+        slabSizes = [self.wallThickness] + [
+            self.pathThickness,
+            self.wallThickness,
+        ] * self.gridSize
+        return np.concatenate([[0], np.cumsum(slabSizes)])
+
+    def getLayerEdges(self) -> np.ndarray:
+        # boundaries of the floor and path layers along z
+        return np.array([0, self.floorThickness, self.levelSizeZ])
+
+    def getCarvedGrids(self):
+        # (2n+1, 2n+1) masks of the slab cells removed from the path layer and
+        # from the floor layer, matching createLevelRooms and createRoomConnections
+        cd = ConnectionDirection
+        slabCount = 2 * self.gridSize + 1
+        pathLayer = np.zeros((slabCount, slabCount), dtype=bool)
+        floorLayer = np.zeros((slabCount, slabCount), dtype=bool)
+        isConnected = self.isConnected.astype(bool)
+        pathLayer[1::2, 1::2] = self.isRoom.astype(bool)
+        pathLayer[2:-1:2, 1::2] |= isConnected[:-1, :, cd.x_positive]
+        pathLayer[1::2, 2:-1:2] |= isConnected[:, :-1, cd.y_positive]
+        floorLayer[1::2, 1::2] = isConnected[:, :, cd.z_negative]
+        return pathLayer, floorLayer
+
     def _getRoomCorner(self, i: int, j: int) -> np.ndarray:
         return np.array([i * self.roomSize, j * self.roomSize])
 
@@ -101,9 +132,8 @@ class LabyrinthLevel:
 
         return solidRooms
 
-    def getWindowSolid(
-        self, i: int, j: int, dir: Literal["xp, xn, yp, yn"]
-    ) -> OpenSCADObject:
+    def getWindowPlacement(self, i: int, j: int, dir: Literal["xp, xn, yp, yn"]):
+        # center, rotation and size of the window cube from room (i, j) to the outside
         pathSize = self.pathThickness
         center = self.get3dRoomCenter(i, j)
         levelMaxXY = self.levelSizeXY
@@ -128,23 +158,35 @@ class LabyrinthLevel:
             size = [pathSize / 3, distToOutside, pathSize / 3]
             rotation = np.array([0, 45, 0])
 
-        wcube = translate((center + outside) / 2)(
-            rotate(a=rotation)(cube(size, center=True))
-        )
+        return (center + outside) / 2, rotation, size
+
+    def getWindowSolid(
+        self, i: int, j: int, dir: Literal["xp, xn, yp, yn"]
+    ) -> OpenSCADObject:
+        position, rotation, size = self.getWindowPlacement(i, j, dir)
+        wcube = translate(position)(rotate(a=rotation)(cube(size, center=True)))
         return wcube
 
-    def getAllWindows(self) -> OpenSCADObject:
-        windows = []
+    def getWindowPlacements(self):
+        placements = []
         for i in range(self.gridSize):
             for j in range(self.gridSize):
                 if i == 0:
-                    windows.append(self.getWindowSolid(i, j, "xn"))
+                    placements.append(self.getWindowPlacement(i, j, "xn"))
                 if j == 0:
-                    windows.append(self.getWindowSolid(i, j, "yn"))
+                    placements.append(self.getWindowPlacement(i, j, "yn"))
                 if i == self.gridSize - 1:
-                    windows.append(self.getWindowSolid(i, j, "xp"))
+                    placements.append(self.getWindowPlacement(i, j, "xp"))
                 if j == self.gridSize - 1:
-                    windows.append(self.getWindowSolid(i, j, "yp"))
+                    placements.append(self.getWindowPlacement(i, j, "yp"))
+        return placements
+
+    def getAllWindows(self) -> OpenSCADObject:
+        windows = []
+        for position, rotation, size in self.getWindowPlacements():
+            windows.append(
+                translate(position)(rotate(a=rotation)(cube(size, center=True)))
+            )
         return union()(windows)
 
     def getXYConnection(self, i, j, type: Literal["X", "Y"]) -> OpenSCADObject:
@@ -192,7 +234,35 @@ class LabyrinthLevel:
 
         return solidConnections
 
+    def getSolidKey(self) -> tuple:
+        # everything the solid depends on, the cached solid is rebuilt when it changes
+        isConnected, isRoom = np.asarray(self.isConnected), np.asarray(self.isRoom)
+        return (
+            self.wallThickness,
+            self.pathThickness,
+            self.hasWindows,
+            isConnected.shape,
+            isConnected.tobytes(),
+            isRoom.tobytes(),
+        )
+
     def getSolidLevel(self) -> OpenSCADObject:
+        # shared by the .scad file and the cube, casing and map views; the
+        # memoized solid must not be modified (no add, set_modifier, ...),
+        # build new objects around it instead
+        key = self.getSolidKey()
+        if self._solidCache.get("key") != key:
+            self._solidCache = {"key": key, "solid": self.createSolidLevel()}
+        return self._solidCache["solid"]
+
+    def getScadCode(self) -> str:
+        solid = self.getSolidLevel()
+        if "code" not in self._solidCache:
+            self._solidCache["code"] = scad_render(solid)
+        return self._solidCache["code"]
+
+    @traced("createSolidLevel")
+    def createSolidLevel(self) -> OpenSCADObject:
 
         base = self.createLevelBase()
         rooms = self.createLevelRooms()
@@ -206,8 +276,46 @@ class LabyrinthLevel:
 
         return level
 
-    def createScadFile(self, name):
-        scad_render_to_file(self.getSolidLevel(), f"{name}.scad")
+    def getOutlineSolidLevel(self) -> OpenSCADObject:
+        # same solid as getSolidLevel, but the carved area of each layer is a
+        # single traced polygon instead of a union of squares
+        from labyrinth_contour import traceContours, getContourPaths
+
+        pathLayer, floorLayer = self.getCarvedGrids()
+        slabEdges = self.getSlabEdges()
+        cuts = []
+        for layer, z, height in [
+            (floorLayer, 0, self.floorThickness),
+            (pathLayer, self.floorThickness, self.pathThickness),
+        ]:
+            loops = traceContours(layer)
+            if loops:
+                points, paths = getContourPaths(loops, slabEdges, slabEdges)
+                cuts.append(
+                    translate([0, 0, z])(linear_extrude(height)(polygon(points, paths)))
+                )
+        if self.hasWindows:
+            cuts.append(self.getAllWindows())
+
+        return difference()([self.createLevelBase(), union()(cuts)])
+
+    @traced("createScadFile")
+    def createScadFile(self, name, mode: str = "tree") -> str:
+        # returns the digest of the scad code, used as artifact cache key;
+        # "data" writes a module with coordinate arrays instead of the tree,
+        # "outline" one traced polygon per carved layer
+        if mode == "data":
+            from labyrinth_scad import writeLevelScad
+
+            return writeLevelScad(self, name)
+        if mode == "outline":
+            code = scad_render(self.getOutlineSolidLevel())
+        else:
+            # the memoized code, the solid is serialized only once
+            code = self.getScadCode()
+        with open(f"{name}.scad", "w") as scadFile:
+            scadFile.write(code)
+        return getCodeDigest(code)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,49 @@
-import os
+import os, struct, zlib
 import numpy as np
 from solid import *
 from subprocess import run
 
 from labyrinth_cube import LabyrinthCube
+from labyrinth_level import LabyrinthLevel
+from labyrinth_scad import getLevelInstance
+
+
+# map colors of the top view as in the openscad "Nature" color scheme:
+# walls, floor of the paths, holes in the floor (background shows through)
+WALL_COLOR = (17, 125, 106)
+PATH_COLOR = (171, 190, 171)
+HOLE_COLOR = (250, 250, 250)
+BACKGROUND_COLOR = (250, 250, 250)
+
+
+def get_level_labels(level: LabyrinthLevel) -> np.ndarray:
+    # (2n+1, 2n+1) top view of the slab cells: 0 wall, 1 path, 2 floor hole
+    path_layer, floor_layer = level.getCarvedGrids()
+    labels = path_layer.astype(np.uint8)
+    labels[floor_layer] = 2
+    return labels
+
+
+def write_png(path: str, image: np.ndarray):
+    # minimal writer for an (height, width, 3) uint8 rgb image
+    height, width, _ = image.shape
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        content = kind + data
+        return (
+            struct.pack(">I", len(data))
+            + content
+            + struct.pack(">I", zlib.crc32(content))
+        )
+
+    with open(path, "wb") as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        png.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        png.write(chunk(b"IEND", b""))
+
 
 
 class LabyrinthMap:
@@ -28,8 +68,79 @@ class LabyrinthMap:
         overall_width = self.dim_2d_size*self.step_2d-self.spacing
         return overall_width
 
-    def get_solid_layout(self) -> OpenSCADObject:
-        solid_levels = list(reversed([level.getSolidLevel() for level in self.lcube.levels]))
+    def get_level_offsets(self):
+        # top left corner of every level in the top down view (y pointing down),
+        # same tiling as get_solid_layout, top level first
+        levels = list(reversed(self.lcube.levels))
+        offsets = []
+        for index, level in enumerate(levels):
+            i, j = index % self.dim_2d_size, index // self.dim_2d_size
+            offsets.append((level, i * self.step_2d, j * self.step_2d))
+        return offsets
+
+    def rasterize(self, width: int = 2000) -> np.ndarray:
+        scale = width / self.overall_width
+        image = np.empty((width, width, 3), dtype=np.uint8)
+        image[:] = BACKGROUND_COLOR
+        colors = np.array([WALL_COLOR, PATH_COLOR, HOLE_COLOR], dtype=np.uint8)
+        for level, x, y in self.get_level_offsets():
+            labels = get_level_labels(level)
+            slab_edges = level.getSlabEdges()
+            x0, x1 = int(round(x * scale)), int(round((x + level.levelSizeXY) * scale))
+            y0, y1 = int(round(y * scale)), int(round((y + level.levelSizeXY) * scale))
+            # slab of every pixel center, rows run against the level y axis
+            columns = (np.arange(x0, x1) + 0.5) / scale - x
+            rows = level.levelSizeXY - ((np.arange(y0, y1) + 0.5) / scale - y)
+            slab_x = np.clip(
+                np.searchsorted(slab_edges, columns) - 1, 0, len(labels) - 1
+            )
+            slab_y = np.clip(np.searchsorted(slab_edges, rows) - 1, 0, len(labels) - 1)
+            image[y0:y1, x0:x1] = colors[labels[np.ix_(slab_x, slab_y)].T]
+        return image
+
+    def get_svg(self) -> str:
+        def rect(x, y, w, h, color):
+            fill = "#%02x%02x%02x" % color
+            return f'<rect x="{x:.3f}" y="{y:.3f}" width="{w:.3f}" height="{h:.3f}" fill="{fill}"/>'
+
+        width = self.overall_width
+        elements = [rect(0, 0, width, width, BACKGROUND_COLOR)]
+        colors = [None, PATH_COLOR, HOLE_COLOR]
+        for level, x, y in self.get_level_offsets():
+            size = level.levelSizeXY
+            slab_edges = level.getSlabEdges()
+            elements.append(rect(x, y, size, size, WALL_COLOR))
+            labels = get_level_labels(level)
+            for i, j in zip(*np.nonzero(labels)):
+                elements.append(
+                    rect(
+                        x + slab_edges[i],
+                        y + size - slab_edges[j + 1],
+                        slab_edges[i + 1] - slab_edges[i],
+                        slab_edges[j + 1] - slab_edges[j],
+                        colors[labels[i, j]],
+                    )
+                )
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.3f}mm" '
+            f'height="{width:.3f}mm" viewBox="0 0 {width:.3f} {width:.3f}">\n'
+            + "\n".join(elements)
+            + "\n</svg>\n"
+        )
+
+    def render_map(self, path, width: int = 2000):
+        # map.png and map.svg straight from the level arrays, without openscad
+        write_png(os.path.join(path, "map.png"), self.rasterize(width))
+        with open(os.path.join(path, "map.svg"), "w") as svg:
+            svg.write(self.get_svg())
+
+    def get_solid_layout(self, instanced: bool = False) -> OpenSCADObject:
+        # instanced refers to the level modules of writeLevelModules
+        solid_levels = [
+            getLevelInstance(k) if instanced else level.getSolidLevel()
+            for k, level in enumerate(self.lcube.levels)
+        ]
+        solid_levels.reverse()
         
         layout = union()
         for i in range(self.dim_2d_size):
@@ -52,8 +163,8 @@ class LabyrinthMap:
         
         xy_center = np.ones(2)*(self.overall_width/2)
         cam_z = self.overall_width*2.6
-        ex, ey, ez = np.array([*xy_center, cam_z], dtype=np.int)
-        cx, cy, cz = np.array([*xy_center, 0], dtype=np.int)
+        ex, ey, ez = np.array([*xy_center, cam_z], dtype=int)
+        cx, cy, cz = np.array([*xy_center, 0], dtype=int)
         print(f"--camera=eye_{ex},{ey},{ez},center_{cx},{cy},{cz}",)
         run(
             [
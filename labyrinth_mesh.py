@@ -0,0 +1,214 @@
+from typing import List, Tuple
+import numpy as np
+
+from labyrinth_level import LabyrinthLevel
+from labyrinth_stl import writeBinaryStl
+from labyrinth_trace import traced
+
+
+def getFaceMasks(isSolid: np.ndarray):
+    # for every axis and facing direction: mask of shape (planes, cells u,
+    # cells v) of the voxel faces on the lattice planes along axis, where
+    # (axis, u, v) is a cyclic permutation of (x, y, z)
+    for axis in range(3):
+        u, v = (axis + 1) % 3, (axis + 2) % 3
+        padding = [(0, 0)] * 3
+        padding[axis] = (1, 1)
+        padded = np.pad(isSolid, padding)
+        planeCount = isSolid.shape[axis] + 1
+        # lower is the cell before a plane, upper the cell after it
+        lower = np.take(padded, np.arange(planeCount), axis=axis)
+        upper = np.take(padded, np.arange(1, planeCount + 1), axis=axis)
+        for isFace, reverse in [(lower & ~upper, False), (upper & ~lower, True)]:
+            yield axis, reverse, np.transpose(isFace, (axis, u, v))
+
+
+def getLatticeIds(axis: int, plane, uIds, vIds, latticeShape) -> np.ndarray:
+    location = [None] * 3
+    location[axis], location[(axis + 1) % 3], location[(axis + 2) % 3] = (
+        plane,
+        uIds,
+        vIds,
+    )
+    return np.ravel_multi_index(np.broadcast_arrays(*location), latticeShape)
+
+
+def getVertices(latticeIds: np.ndarray, edges) -> np.ndarray:
+    location = np.unravel_index(latticeIds, tuple(len(e) for e in edges))
+    return np.stack([e[l] for e, l in zip(edges, location)], axis=1).astype(float)
+
+
+def getVoxelSurface(
+    isSolid: np.ndarray, edges: Tuple[np.ndarray, np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    # boundary of a union of voxels on a rectilinear grid with the given cell
+    # edges per axis; returns vertices (V, 3) and outward facing triangles (F, 3)
+    latticeShape = tuple(len(e) for e in edges)
+
+    quads = []
+    for axis, reverse, faceMask in getFaceMasks(isSolid):
+        plane, uIds, vIds = np.nonzero(faceMask)
+        corners = [
+            getLatticeIds(axis, plane, uIds + du, vIds + dv, latticeShape)
+            for du, dv in [(0, 0), (1, 0), (1, 1), (0, 1)]
+        ]
+        if reverse:
+            corners.reverse()
+        quads.append(np.stack(corners, axis=1))
+
+    quads = np.concatenate(quads)
+    faces = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    usedIds, faces = np.unique(faces, return_inverse=True)
+    return getVertices(usedIds, edges), faces.reshape(-1, 3)
+
+
+def getMaximalRectangles(mask: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    # greedy cover of a 2d mask with rectangles (u0, v0, u1, v1), end exclusive
+    free = mask.copy()
+    rectangles = []
+    for u0, v0 in zip(*np.nonzero(mask)):
+        if not free[u0, v0]:
+            continue
+        v1 = v0 + 1
+        while v1 < free.shape[1] and free[u0, v1]:
+            v1 += 1
+        u1 = u0 + 1
+        while u1 < free.shape[0] and free[u1, v0:v1].all():
+            u1 += 1
+        free[u0:u1, v0:v1] = False
+        rectangles.append((int(u0), int(v0), int(u1), int(v1)))
+    return rectangles
+
+
+def getMergedVoxelSurface(
+    isSolid: np.ndarray, edges: Tuple[np.ndarray, np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    # like getVoxelSurface, but coplanar faces are merged into maximal rectangles;
+    # corners of other rectangles on a rectangle border are kept as vertices of
+    # that rectangle (fanned around its center), so the mesh stays watertight
+    latticeShape = tuple(len(e) for e in edges)
+    rectangles = []
+    isCorner = np.zeros(latticeShape, dtype=bool).ravel()
+    for axis, reverse, faceMask in getFaceMasks(isSolid):
+        for plane, mask in enumerate(faceMask):
+            for u0, v0, u1, v1 in getMaximalRectangles(mask):
+                rectangles.append((axis, reverse, plane, u0, v0, u1, v1))
+                corners = getLatticeIds(
+                    axis, plane, [u0, u1, u1, u0], [v0, v0, v1, v1], latticeShape
+                )
+                isCorner[corners] = True
+
+    vertices = []
+    faces = []
+    centerId = isCorner.size
+    for axis, reverse, plane, u0, v0, u1, v1 in rectangles:
+        # border of the rectangle counter clockwise in (u, v), without end points
+        uIds = np.r_[u0:u1, [u1] * (v1 - v0), u1:u0:-1, [u0] * (v1 - v0)]
+        vIds = np.r_[[v0] * (u1 - u0), v0:v1, [v1] * (u1 - u0), v1:v0:-1]
+        border = getLatticeIds(axis, plane, uIds, vIds, latticeShape)
+        border = border[isCorner[border]]
+        if reverse:
+            border = border[::-1]
+        if len(border) == 4:
+            faces += [border[[0, 1, 2]], border[[0, 2, 3]]]
+        else:
+            corners = getVertices(border, edges)
+            vertices.append(corners.mean(axis=0))
+            fan = np.stack([border, np.roll(border, -1)], axis=1)
+            faces.append(np.c_[fan, np.full(len(fan), centerId)])
+            centerId += 1
+
+    faces = np.concatenate([np.reshape(f, (-1, 3)) for f in faces])
+    isCenter = faces >= isCorner.size
+    usedIds, latticeFaces = np.unique(faces[~isCenter], return_inverse=True)
+    faces[~isCenter] = latticeFaces.ravel()
+    faces[isCenter] += len(usedIds) - isCorner.size
+    allVertices = [getVertices(usedIds, edges)] + [np.reshape(vertices, (-1, 3))]
+    return np.concatenate(allVertices), faces
+
+
+def getLevelVoxels(level: LabyrinthLevel):
+    # solid slab cells of a level without windows, shape (2n+1, 2n+1, 2)
+    pathLayer, floorLayer = level.getCarvedGrids()
+    isSolid = np.stack([~floorLayer, ~pathLayer], axis=2)
+    edges = (level.getSlabEdges(), level.getSlabEdges(), level.getLayerEdges())
+    return isSolid, edges
+
+
+def canMeshLevel(level: LabyrinthLevel) -> bool:
+    # the 45 degree windows are only available through openscad
+    return not level.hasWindows
+
+
+def getLevelMesh(
+    level: LabyrinthLevel, merge: bool = True
+) -> Tuple[np.ndarray, np.ndarray]:
+    # the windows are not cut into the mesh, callers send the levels that
+    # canMeshLevel rejects to openscad (see create_level_stl in main.py)
+    if merge:
+        return getMergedVoxelSurface(*getLevelVoxels(level))
+    return getVoxelSurface(*getLevelVoxels(level))
+
+
+def getUnmergedTriangleCount(isSolid: np.ndarray) -> int:
+    return 2 * sum(int(faceMask.sum()) for _, _, faceMask in getFaceMasks(isSolid))
+
+
+def getMeshVolume(vertices: np.ndarray, faces: np.ndarray) -> float:
+    triangles = vertices[faces]
+    return (
+        np.einsum(
+            "ij,ij->i", triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])
+        ).sum()
+        / 6
+    )
+
+
+def isWatertight(faces: np.ndarray) -> bool:
+    # every directed edge has to appear once and its reverse once as well
+    directed = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    unique, counts = np.unique(directed, axis=0, return_counts=True)
+    if np.any(counts != 1):
+        return False
+    reverse = np.unique(directed[:, ::-1], axis=0)
+    return np.array_equal(unique, reverse)
+
+
+@traced("createLevelStl")
+def createLevelStl(level: LabyrinthLevel, name: str, merge: bool = True):
+    # returns the triangle counts before and after merging coplanar faces;
+    # only for levels that canMeshLevel accepts
+    vertices, faces = getLevelMesh(level, merge)
+    writeBinaryStl(f"{name}.stl", vertices, faces, header=b"labyrinth level")
+    return getUnmergedTriangleCount(getLevelVoxels(level)[0]), len(faces)
+
+
+if __name__ == "__main__":
+
+    import time
+    from labyrinth_graph import LabyrinthGraph
+
+    lgraph = LabyrinthGraph(10)
+    lgraph.setRandomTree(8)
+    lcube = lgraph.getLabyrinthCube(1.2, 15, 17)
+
+    for level in lcube.levels[:3]:
+        start = time.perf_counter()
+        vertices, faces = getLevelMesh(level)
+        duration = time.perf_counter() - start
+        unmergedCount = getUnmergedTriangleCount(getLevelVoxels(level)[0])
+
+        pathLayer, floorLayer = level.getCarvedGrids()
+        slabSizes = np.diff(level.getSlabEdges())
+        slabAreas = np.outer(slabSizes, slabSizes)
+        expectedVolume = (
+            level.levelSizeXY**2 * level.levelSizeZ
+            - np.sum(slabAreas[pathLayer]) * level.pathThickness
+            - np.sum(slabAreas[floorLayer]) * level.floorThickness
+        )
+        print(
+            f"{unmergedCount} -> {len(faces)} triangles in {duration * 1000:.1f} ms, "
+            f"watertight: {isWatertight(faces)}, "
+            f"volume {getMeshVolume(vertices, faces):.3f} "
+            f"(expected {expectedVolume:.3f})"
+        )
@@ -0,0 +1,109 @@
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, CalledProcessError, TimeoutExpired
+from typing import List, Optional
+
+from labyrinth_cache import ArtifactCache
+from labyrinth_stl import convertToBinaryStl
+from labyrinth_trace import traced
+
+
+class RenderResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.attempts = 0
+        self.seconds = 0.0
+        self.cached = False
+        self.error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return (self.attempts > 0 or self.cached) and self.error is None
+
+
+@traced("openscad")
+def renderStl(name: str, timeout: Optional[float] = None):
+    # renders {name}.scad to a binary {name}.stl, raises on failure or timeout
+    run(
+        ["openscad", "-q", "--o", f"{name}.stl", f"{name}.scad"],
+        check=True,
+        timeout=timeout,
+        capture_output=True,
+    )
+    convertToBinaryStl(f"{name}.stl")
+
+
+def renderWithRetries(
+    name: str, timeout: Optional[float] = None, retries: int = 1
+) -> RenderResult:
+    result = RenderResult(name)
+    start = time.perf_counter()
+    while result.attempts <= retries:
+        result.attempts += 1
+        try:
+            renderStl(name, timeout)
+            result.error = None
+            break
+        except CalledProcessError as e:
+            result.error = f"openscad exited with {e.returncode}: {e.stderr}"
+        except TimeoutExpired:
+            result.error = f"openscad timed out after {timeout} s"
+        except FileNotFoundError:
+            result.error = "openscad not found"
+            break
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def renderCached(
+    name: str,
+    key: Optional[str],
+    cache: Optional[ArtifactCache],
+    timeout: Optional[float] = None,
+    retries: int = 1,
+) -> RenderResult:
+    # key is the scad digest returned by createScadFile
+    if cache is None or key is None:
+        return renderWithRetries(name, timeout, retries)
+    with cache.lock(key):
+        if cache.fetch(key, f"{name}.stl"):
+            result = RenderResult(name)
+            result.cached = True
+            return result
+        result = renderWithRetries(name, timeout, retries)
+        if result.success:
+            cache.store(key, f"{name}.stl")
+    return result
+
+
+def renderAll(
+    names: List[str],
+    maxWorkers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retries: int = 1,
+    keys: Optional[List[str]] = None,
+    cache: Optional[ArtifactCache] = None,
+) -> List[RenderResult]:
+    # openscad runs in its own process, so threads are enough to keep
+    # maxWorkers renders going at the same time
+    maxWorkers = maxWorkers or os.cpu_count()
+    keys = keys or [None] * len(names)
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        return list(
+            executor.map(
+                lambda name, key: renderCached(name, key, cache, timeout, retries),
+                names,
+                keys,
+            )
+        )
+
+
+def printSummary(results: List[RenderResult], wallTime: float):
+    width = max([len(os.path.basename(r.name)) for r in results] + [4])
+    print(f"{'part':<{width}} {'seconds':>8} {'tries':>5}  status")
+    for r in results:
+        status = "cached" if r.cached else "ok" if r.success else r.error
+        print(
+            f"{os.path.basename(r.name):<{width}} {r.seconds:8.2f} {r.attempts:5}  {status}"
+        )
+    print(f"rendered {len(results)} parts in {wallTime:.2f} s")
@@ -0,0 +1,153 @@
+from typing import Dict, List
+import numpy as np
+from solid import OpenSCADObject
+from solid.solidpython import py2openscad
+
+from labyrinth_cache import getCodeDigest
+from labyrinth_level import ConnectionDirection, LabyrinthLevel
+
+# one level as a parametric module: the carved rooms and connections are placed
+# by for loops over coordinate arrays instead of one tree node per square
+LEVEL_MODULE = """module labyrinth_level(size_xy, size_z, wall, floor, path,
+		rooms, room_size, x_connections, x_size, y_connections, y_size,
+		z_connections, z_size, windows) {
+	difference() {
+		linear_extrude(height = size_z) square(size = size_xy);
+		union() {
+			translate(v = [wall, wall, floor]) linear_extrude(height = path) {
+				for (corner = rooms) translate(v = corner) square(size = room_size);
+			}
+			translate(v = [wall, wall]) {
+				translate(v = [0, 0, floor]) linear_extrude(height = path) {
+					for (corner = x_connections) translate(v = corner) square(size = x_size);
+					for (corner = y_connections) translate(v = corner) square(size = y_size);
+				}
+				linear_extrude(height = floor) {
+					for (corner = z_connections) translate(v = corner) square(size = z_size);
+				}
+			}
+			for (window = windows) translate(v = window[0])
+				rotate(a = window[1]) cube(center = true, size = window[2]);
+		}
+	}
+}
+"""
+
+LEVEL_PARAMETERS = [
+    "size_xy",
+    "size_z",
+    "wall",
+    "floor",
+    "path",
+    "rooms",
+    "room_size",
+    "x_connections",
+    "x_size",
+    "y_connections",
+    "y_size",
+    "z_connections",
+    "z_size",
+    "windows",
+]
+
+
+def formatCorners(corners: np.ndarray, decimals: int) -> str:
+    # the same rounding solidpython applies, python floats are written with 10
+    # and numpy arrays with 8 decimals, so the parsed coordinates are identical
+    if len(corners) == 0:
+        return "[]"
+    pointFormat = ", ".join([f"%.{decimals}f"] * corners.shape[1])
+    points = "], [".join(pointFormat % tuple(c) for c in corners.tolist())
+    return f"[[{points}]]"
+
+
+def getLevelData(level: LabyrinthLevel) -> Dict[str, str]:
+    # scad values of the module parameters, computed like getSolidLevel does
+    cd = ConnectionDirection
+    n = level.gridSize
+    roomSize = level.roomSize
+    isConnected = np.asarray(level.isConnected).astype(bool)
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    iCorner, jCorner = i * roomSize, j * roomSize
+    offset = level.wallThickness + level.eps
+
+    isRoom = np.asarray(level.isRoom).astype(bool)
+    # connections to a room outside the level are not carved
+    isX = isConnected[:, :, cd.x_positive] & (i < n - 1)
+    isY = isConnected[:, :, cd.y_positive] & (j < n - 1)
+    isZ = isConnected[:, :, cd.z_negative]
+    windows = level.getWindowPlacements() if level.hasWindows else []
+
+    return {
+        "size_xy": py2openscad(level.levelSizeXY),
+        "size_z": py2openscad(level.levelSizeZ),
+        "wall": py2openscad(level.wallThickness),
+        "floor": py2openscad(level.floorThickness),
+        "path": py2openscad(level.pathThickness),
+        "rooms": formatCorners(np.stack([iCorner[isRoom], jCorner[isRoom]], 1), 10),
+        "room_size": py2openscad(np.ones(2) * level.pathThickness),
+        "x_connections": formatCorners(
+            np.stack([(i[isX] + 1) * roomSize - offset, jCorner[isX]], 1), 8
+        ),
+        "x_size": py2openscad(level.connectionSizeX),
+        "y_connections": formatCorners(
+            np.stack([iCorner[isY], (j[isY] + 1) * roomSize - offset], 1), 8
+        ),
+        "y_size": py2openscad(level.connectionSizeY),
+        "z_connections": formatCorners(np.stack([iCorner[isZ], jCorner[isZ]], 1), 8),
+        "z_size": py2openscad([level.pathThickness, level.pathThickness]),
+        "windows": py2openscad(windows),
+    }
+
+
+def getLevelScad(level: LabyrinthLevel) -> str:
+    data = getLevelData(level)
+    lines = [f"{name} = {data[name]};" for name in LEVEL_PARAMETERS]
+    call = ", ".join(f"{name} = {name}" for name in LEVEL_PARAMETERS)
+    return "\n".join([LEVEL_MODULE, *lines, "", f"labyrinth_level({call});", ""])
+
+
+def writeLevelScad(level: LabyrinthLevel, name: str) -> str:
+    # returns the digest of the scad code, used as artifact cache key
+    code = getLevelScad(level)
+    with open(f"{name}.scad", "w") as scadFile:
+        scadFile.write(code)
+    return getCodeDigest(code)
+
+
+def getLevelInstance(index: int) -> OpenSCADObject:
+    # reference to the module of a level, see writeLevelModules
+    return OpenSCADObject(f"level{index}", {})
+
+
+def writeLevelModules(levels: List[LabyrinthLevel], path: str):
+    # every level once as module level<index>, views "use" this file and
+    # instance the levels instead of repeating their geometry
+    with open(path, "w") as scadFile:
+        for index, level in enumerate(levels):
+            scadFile.write(f"module level{index}() {{{level.getScadCode()}}}\n\n")
+
+
+if __name__ == "__main__":
+
+    import os, tempfile, time
+    from labyrinth_graph import LabyrinthGraph
+
+    directory = tempfile.mkdtemp()
+    for cubeSize in [10, 20, 50]:
+        lgraph = LabyrinthGraph(cubeSize)
+        lgraph.setRandomTree(8, generator="fast")
+        lcube = lgraph.getLabyrinthCube(1.2, 15, 17)
+        lcube.addAllWindows()
+        level = lcube.levels[cubeSize // 2]
+
+        for mode in ["tree", "data", "outline"]:
+            name = os.path.join(directory, f"level_{cubeSize}_{mode}")
+            start = time.perf_counter()
+            level.createScadFile(name, mode)
+            duration = time.perf_counter() - start
+            size = os.path.getsize(f"{name}.scad")
+            print(
+                f"cubeSize {cubeSize:>3} {mode}: {duration * 1000:8.1f} ms, "
+                f"{size / 1024:8.1f} KiB"
+            )
@@ -0,0 +1,227 @@
+import argparse, operator, os, time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from labyrinth_config import LabyrinthConfig
+from labyrinth_graph import LabyrinthGraph
+from labyrinth_tree import getNeighborLists, getTreeDistances
+
+METRICS = ["solutionLength", "levelChanges", "deadEnds", "branching", "diameter"]
+
+REQUIREMENT_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+def getMetrics(lgraph: LabyrinthGraph) -> Dict[str, float]:
+    # difficulty of a maze from its graph alone, the solution runs from the top
+    # to the bottom corner like the path visualization
+    indptr, indices = lgraph.getAdjacency()
+    neighbors = getNeighborLists(indptr, indices)
+    degrees = np.diff(indptr)
+
+    startId, goalId = lgraph.topCornerNode.cellId, lgraph.bottomCornerNode.cellId
+    distances, parents = getTreeDistances(neighbors, startId)
+    path = [goalId]
+    while parents[path[-1]] not in (path[-1], -1):
+        path.append(parents[path[-1]])
+    # z is the fastest changing index of a cell id
+    pathLevels = np.array(path) % lgraph.cubeSize
+    farthestId = int(np.argmax(distances))
+    passages = degrees[degrees > 1]
+
+    return {
+        "solutionLength": len(path) - 1,
+        "levelChanges": int(np.count_nonzero(np.diff(pathLevels))),
+        "deadEnds": int(np.count_nonzero(degrees == 1)),
+        # ways on at cells that are not dead ends
+        "branching": float(passages.mean() - 1) if len(passages) else 0.0,
+        "diameter": max(getTreeDistances(neighbors, farthestId)[0]),
+    }
+
+
+def parseObjective(objective: str) -> Dict[str, float]:
+    # "solutionLength=1,levelChanges=2" -> weights of the metrics
+    weights = {}
+    for term in objective.split(","):
+        name, weight = term.split("=")
+        if name.strip() not in METRICS:
+            raise ValueError(f"unknown metric {name}, use one of {', '.join(METRICS)}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def parseRequirement(requirement: str) -> Tuple[str, str, float]:
+    # "levelChanges>=8" -> ("levelChanges", ">=", 8.0)
+    for symbol in REQUIREMENT_OPERATORS:
+        name, found, value = requirement.partition(symbol)
+        if found:
+            if name.strip() not in METRICS:
+                raise ValueError(f"unknown metric {name}")
+            return name.strip(), symbol, float(value)
+    raise ValueError(f"no comparison in requirement {requirement}")
+
+
+def getScore(metrics: Dict[str, float], objective: Dict[str, float]) -> float:
+    return sum(weight * metrics[name] for name, weight in objective.items())
+
+
+def isQualified(metrics: Dict[str, float], requirements) -> bool:
+    return all(
+        REQUIREMENT_OPERATORS[symbol](metrics[name], value)
+        for name, symbol, value in requirements
+    )
+
+
+def _generateGraphs(cubeSize: int, seeds: List[int], generator: str):
+    if generator == "boruvka":
+        # the whole chunk in one batched pass, the same mazes as setRandomTree
+        from labyrinth_generator import carveBoruvkaTrees, getBoruvkaStream
+
+        streams = [getBoruvkaStream(seed) for seed in seeds]
+        for connections in carveBoruvkaTrees((cubeSize,) * 3, streams):
+            yield LabyrinthGraph.fromConnections(connections)
+        return
+    for seed in seeds:
+        lgraph = LabyrinthGraph(cubeSize)
+        lgraph.setRandomTree(seed, generator=generator)
+        yield lgraph
+
+
+def _evaluateSeeds(arguments) -> Tuple[int, List[Tuple[int, Dict[str, float]]]]:
+    # runs in a worker process, returns only the seeds that qualify
+    cubeSize, seeds, generator, requirements = arguments
+    qualified = []
+    for seed, lgraph in zip(seeds, _generateGraphs(cubeSize, seeds, generator)):
+        metrics = getMetrics(lgraph)
+        if isQualified(metrics, requirements):
+            qualified.append((seed, metrics))
+    return len(seeds), qualified
+
+
+def searchSeeds(
+    cubeSize: int,
+    seeds: range,
+    objective: Dict[str, float],
+    requirements: List[Tuple[str, str, float]] = (),
+    enough: Optional[int] = None,
+    top: int = 10,
+    generator: str = "compat",
+    processes: Optional[int] = None,
+    chunkSize: int = 500,
+):
+    # evaluates the seeds in chunks, stops early once enough seeds qualify;
+    # returns the number of evaluated seeds and the best (score, seed, metrics)
+    chunks = iter([seeds[i : i + chunkSize] for i in range(0, len(seeds), chunkSize)])
+    jobs = ((cubeSize, chunk, generator, list(requirements)) for chunk in chunks)
+    evaluated, qualified = 0, []
+
+    def isEnough() -> bool:
+        return enough is not None and len(qualified) >= enough
+
+    if processes == 1:
+        for job in jobs:
+            count, results = _evaluateSeeds(job)
+            evaluated, qualified = evaluated + count, qualified + results
+            if isEnough():
+                break
+    else:
+        processes = processes or os.cpu_count()
+        with ProcessPoolExecutor(processes) as executor:
+            # a few chunks per worker in flight, so stopping wastes little work
+            pending = set()
+            for job in jobs:
+                pending.add(executor.submit(_evaluateSeeds, job))
+                if len(pending) >= 2 * processes:
+                    break
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    count, results = future.result()
+                    evaluated, qualified = evaluated + count, qualified + results
+                if isEnough():
+                    for future in pending:
+                        future.cancel()
+                    break
+                for _, job in zip(done, jobs):
+                    pending.add(executor.submit(_evaluateSeeds, job))
+
+    ranked = sorted(
+        [(getScore(metrics, objective), seed, metrics) for seed, metrics in qualified],
+        key=lambda result: (-result[0], result[1]),
+    )
+    return evaluated, ranked[:top]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser("Search seeds for difficult Labyrinth Cubes")
+    parser.add_argument("c", help="name of the config, sets the cube size")
+    parser.add_argument(
+        "--objective",
+        help="weights of the metrics to maximize, e.g. solutionLength=1,levelChanges=2 "
+        f"(metrics: {', '.join(METRICS)})",
+        dest="objective",
+    )
+    parser.add_argument(
+        "--require",
+        help="conditions a seed has to meet, e.g. levelChanges>=8",
+        dest="require",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--enough", help="stop once this many seeds qualify", dest="enough", type=int
+    )
+    parser.add_argument("--top", help="number of seeds to list", dest="top", type=int)
+    parser.add_argument("--start", help="first seed", dest="start", type=int)
+    parser.add_argument("--count", help="number of seeds", dest="count", type=int)
+    parser.add_argument(
+        "--generator",
+        help="maze generator, as in main.py",
+        dest="generator",
+        choices=["compat", "fast", "parallel", "eller", "boruvka"],
+    )
+    parser.add_argument(
+        "--processes", help="number of worker processes", dest="processes", type=int
+    )
+    parser.set_defaults(objective="solutionLength=1")
+    parser.set_defaults(require=[])
+    parser.set_defaults(enough=None)
+    parser.set_defaults(top=10)
+    parser.set_defaults(start=0)
+    parser.set_defaults(count=10000)
+    parser.set_defaults(generator="compat")
+    parser.set_defaults(processes=None)
+
+    args = parser.parse_args()
+
+    cubeSize = getattr(LabyrinthConfig, args.c)["cubeSize"]
+    objective = parseObjective(args.objective)
+    requirements = [parseRequirement(r) for r in args.require]
+
+    startTime = time.perf_counter()
+    evaluated, ranked = searchSeeds(
+        cubeSize,
+        range(args.start, args.start + args.count),
+        objective,
+        requirements,
+        args.enough,
+        args.top,
+        args.generator,
+        args.processes,
+    )
+    duration = time.perf_counter() - startTime
+
+    print(f"{'seed':>10} {'score':>8} " + " ".join(f"{m:>14}" for m in METRICS))
+    for score, seed, metrics in ranked:
+        values = " ".join(f"{metrics[m]:>14.4g}" for m in METRICS)
+        print(f"{seed:>10} {score:>8.4g} {values}")
+    print(
+        f"evaluated {evaluated} seeds in {duration:.2f} s "
+        f"({evaluated / duration:.0f} seeds/s)"
+    )
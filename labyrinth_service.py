@@ -0,0 +1,393 @@
+import argparse, asyncio, os, json, hashlib, signal, socket, time, traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict
+
+from labyrinth_batch import normalize_job, graph_key
+
+
+class LruCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.items:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    @property
+    def stats(self) -> dict:
+        return {"size": len(self.items), "hits": self.hits, "misses": self.misses}
+
+
+# per worker process: recently used graphs, and cubes whose levels keep their
+# solids and scad code memoized
+_graphs = LruCache(0)
+_cubes = LruCache(0)
+
+
+def init_worker(cache_size: int):
+    global _graphs, _cubes
+    _graphs, _cubes = LruCache(cache_size), LruCache(cache_size)
+
+
+def build_job(job: dict, path: str, mesher: str, scad_mode: str) -> dict:
+    # runs in a worker process: writes all outputs except the openscad renders,
+    # which are returned as (name, cache key) pairs
+    from main import create_graph, create_cube, create_outputs, needs_cube
+    from main import write_stl_sources
+
+    config, outputs = job["config"], job["outputs"]
+    key = graph_key(job)
+    lgraph = _graphs.get(key)
+    if lgraph is None:
+        lgraph = create_graph(config, job["generator"])
+        _graphs.put(key, lgraph)
+
+    lcube = None
+    if needs_cube(outputs):
+        cube_key = key + (
+            config["levelWallThickness"],
+            config["levelPathThickness"],
+            config["levelSpacing"],
+            job["windows"],
+        )
+        lcube = _cubes.get(cube_key)
+        if lcube is None:
+            lcube = create_cube(lgraph, config, job["windows"])
+            _cubes.put(cube_key, lcube)
+
+    other_outputs = [output for output in outputs if output != "stl"]
+    files = create_outputs(
+        lgraph, lcube, config, job["config_name"], path, other_outputs
+    )
+    render = []
+    if "stl" in outputs:
+        from labyrinth_casing import LabyrinthCasing
+
+        lcase = LabyrinthCasing(
+            lcube, config["casingWallThickness"], config["casingTolerance"]
+        )
+        names, render_names, render_keys = write_stl_sources(
+            lcube, lcase, job["config_name"], path, mesher, scad_mode
+        )
+        files += [f"{name}.{ext}" for name in names for ext in ["scad", "stl"]]
+        render = list(zip(render_names, render_keys))
+    return {
+        "files": files,
+        "render": render,
+        "cache": {"graphs": _graphs.stats, "cubes": _cubes.stats},
+    }
+
+
+class LabyrinthService:
+    def __init__(
+        self,
+        output_path: str,
+        processes: int = None,
+        render_jobs: int = None,
+        cache_size: int = 16,
+        render_options: dict = None,
+        mesher: str = "openscad",
+        scad_mode: str = "tree",
+    ):
+        # render_options: "timeout", "retries" and "cache" as in main.py
+        self.output_path = output_path
+        self.mesher = mesher
+        self.scad_mode = scad_mode
+        self.render_options = {"timeout": None, "retries": 1, "cache": None}
+        self.render_options.update(render_options or {})
+        # one single process pool per worker, so requests for the same graph
+        # always reach the worker whose caches hold it
+        self.cache_size = cache_size
+        self.workers = [
+            self.create_worker() for _ in range(processes or os.cpu_count())
+        ]
+        self.worker_caches: Dict[int, dict] = {}
+        self.restarts = 0
+        # openscad runs in its own process, threads are enough for the renders
+        self.render_pool = ThreadPoolExecutor(render_jobs or os.cpu_count())
+        self.running: Dict[str, asyncio.Future] = {}
+        self.served = 0
+        self.failed = 0
+        self.stopped = None
+
+    def create_worker(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            1, initializer=init_worker, initargs=(self.cache_size,)
+        )
+
+    async def build(self, index: int, job: dict, job_path: str) -> dict:
+        # a worker whose process died stays broken, it is replaced by a new
+        # one (with empty caches) and the job is tried once more there
+        for attempt in range(2):
+            worker = self.workers[index]
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    worker, build_job, job, job_path, self.mesher, self.scad_mode
+                )
+            except BrokenProcessPool:
+                # concurrent jobs of the same worker replace it only once
+                if self.workers[index] is worker:
+                    worker.shutdown(wait=False, cancel_futures=True)
+                    self.workers[index] = self.create_worker()
+                    self.worker_caches.pop(index, None)
+                    self.restarts += 1
+                if attempt:
+                    raise
+
+    def get_worker_index(self, job: dict) -> int:
+        digest = hashlib.sha1(json.dumps(graph_key(job)).encode()).digest()
+        return int.from_bytes(digest[:4], "little") % len(self.workers)
+
+    async def render(self, name: str, key: str):
+        from labyrinth_render import renderCached
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self.render_pool,
+            renderCached,
+            name,
+            key,
+            self.render_options["cache"],
+            self.render_options["timeout"],
+            self.render_options["retries"],
+        )
+
+    async def run_job(self, job: dict) -> dict:
+        start = time.perf_counter()
+        result = {"id": job["id"], "config_name": job["config_name"]}
+        result["seed"] = job["config"]["seed"]
+        try:
+            job_path = os.path.join(self.output_path, job["id"])
+            os.makedirs(job_path, exist_ok=True)
+            index = self.get_worker_index(job)
+            built = await self.build(index, job, job_path)
+            self.worker_caches[index] = built["cache"]
+            renders = await asyncio.gather(
+                *[self.render(name, key) for name, key in built["render"]]
+            )
+            failed = [r for r in renders if not r.success]
+            if failed:
+                errors = [f"{os.path.basename(r.name)}: {r.error}" for r in failed]
+                raise RuntimeError(f"rendering failed for {', '.join(errors)}")
+            result["files"] = built["files"]
+            result["status"] = "ok"
+        except Exception:
+            result["status"] = "error"
+            result["error"] = traceback.format_exc()
+        result["seconds"] = time.perf_counter() - start
+        self.served += 1
+        self.failed += result["status"] != "ok"
+        return result
+
+    async def serve_job(self, request: dict) -> dict:
+        job = normalize_job(request)
+        # identical requests that arrive while the job runs share its result
+        if job["id"] not in self.running:
+            task = asyncio.ensure_future(self.run_job(job))
+            task.add_done_callback(lambda _: self.running.pop(job["id"], None))
+            self.running[job["id"]] = task
+        # a client that disconnects does not cancel the job for the others
+        return await asyncio.shield(self.running[job["id"]])
+
+    def get_stats(self) -> dict:
+        stats = {"status": "ok", "served": self.served, "failed": self.failed}
+        stats["running"] = len(self.running)
+        stats["restarts"] = self.restarts
+        stats["workers"] = [self.worker_caches.get(i) for i in range(len(self.workers))]
+        if self.render_options["cache"] is not None:
+            stats["stl_cache"] = self.render_options["cache"].stats
+        return stats
+
+    async def handle_request(self, request: dict) -> dict:
+        # {"command": "generate"} takes the keys of a batch manifest line
+        command = request.pop("command", "generate")
+        if command == "generate":
+            return await self.serve_job(request)
+        if command == "stats":
+            return self.get_stats()
+        if command == "shutdown":
+            self.stopped.set()
+            return {"status": "ok"}
+        return {"status": "error", "error": f"unknown command {command}"}
+
+    async def handle_client(self, reader, writer):
+        # one json request per line, answered by one json line
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except Exception:
+                    response = {"status": "error", "error": traceback.format_exc()}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        self.stopped = asyncio.Event()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        try:
+            async with server:
+                await self.stopped.wait()
+            await asyncio.gather(*self.running.values())
+        finally:
+            for worker in self.workers:
+                worker.shutdown(cancel_futures=True)
+            self.render_pool.shutdown()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def send_request(socket_path: str, request: dict, timeout: float = None) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + "\n").encode())
+        with client.makefile("r") as response:
+            return json.loads(response.readline())
+
+
+async def check_service(path: str):
+    # self-check: jobs are served and a worker whose process was killed is
+    # replaced instead of failing every later job of its graphs
+    socket_path = os.path.join(path, "service.sock")
+    service = LabyrinthService(path, processes=1, render_jobs=1)
+    serving = asyncio.ensure_future(service.serve(socket_path))
+    while not os.path.exists(socket_path):
+        await asyncio.sleep(0.01)
+
+    async def send(request: dict) -> dict:
+        return await asyncio.to_thread(send_request, socket_path, request)
+
+    request = {"config": "config01", "seed": 8, "outputs": ["maze"]}
+    result = await send(request)
+    assert result["status"] == "ok", result
+    assert os.path.isfile(result["files"][0])
+
+    pid = await asyncio.wrap_future(service.workers[0].submit(os.getpid))
+    os.kill(pid, signal.SIGKILL)
+    for seed in [9, 10]:
+        result = await send({**request, "seed": seed})
+        assert result["status"] == "ok", result
+    stats = await send({"command": "stats"})
+    assert stats["restarts"] == 1 and stats["failed"] == 0, stats
+
+    await send({"command": "shutdown"})
+    await serving
+    print("service check passed")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser("Serve Labyrinth Cubes from a local socket")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the service")
+    serve.add_argument("socket", help="path of the unix socket")
+    serve.add_argument("p", help="path for the job output directories")
+    serve.add_argument(
+        "--processes", help="number of worker processes", dest="processes", type=int
+    )
+    serve.add_argument(
+        "--render-jobs",
+        help="number of parts openscad renders at the same time",
+        dest="render_jobs",
+        type=int,
+    )
+    serve.add_argument(
+        "--cache-size",
+        help="graphs and cubes every worker keeps in memory",
+        dest="cache_size",
+        type=int,
+    )
+    serve.add_argument(
+        "--render-timeout",
+        help="seconds after which an openscad render is aborted",
+        dest="render_timeout",
+        type=float,
+    )
+    serve.add_argument(
+        "--cache",
+        help="directory of a cache for rendered .stl files",
+        dest="cache",
+    )
+    serve.add_argument(
+        "--mesher",
+        help="native writes the .stl of levels without windows directly",
+        dest="mesher",
+        choices=["openscad", "native"],
+    )
+    serve.add_argument(
+        "--scad",
+        help="format of the level .scad files, as in main.py",
+        dest="scad_mode",
+        choices=["tree", "data", "outline"],
+    )
+    serve.set_defaults(processes=None)
+    serve.set_defaults(render_jobs=None)
+    serve.set_defaults(cache_size=16)
+    serve.set_defaults(render_timeout=None)
+    serve.set_defaults(cache=None)
+    serve.set_defaults(mesher="openscad")
+    serve.set_defaults(scad_mode="tree")
+
+    commands.add_parser("check", help="run the service self-check")
+
+    send = commands.add_parser("send", help="send requests and print the responses")
+    send.add_argument("socket", help="path of the unix socket")
+    send.add_argument(
+        "requests",
+        help='json requests, e.g. \'{"config": "config01", "seed": 8, '
+        '"outputs": ["stl"]}\', \'{"command": "stats"}\' or \'{"command": "shutdown"}\'',
+        nargs="+",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from labyrinth_cache import ArtifactCache
+
+        os.makedirs(args.p, exist_ok=True)
+        service = LabyrinthService(
+            args.p,
+            args.processes,
+            args.render_jobs,
+            args.cache_size,
+            {
+                "timeout": args.render_timeout,
+                "cache": ArtifactCache(args.cache) if args.cache else None,
+            },
+            args.mesher,
+            args.scad_mode,
+        )
+        print(f"serving on {args.socket}")
+        asyncio.run(service.serve(args.socket))
+    elif args.command == "check":
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as path:
+            asyncio.run(check_service(path))
+    else:
+        for request in args.requests:
+            print(json.dumps(send_request(args.socket, json.loads(request))))
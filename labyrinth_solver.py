@@ -0,0 +1,47 @@
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+
+
+def getDistanceField(
+    linkTable: np.ndarray,
+    closeOffsets: np.ndarray,
+    sourceIds: Iterable[int],
+    goalId: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # breadth first search from all sources at once, one numpy step per layer;
+    # returns the distance to the closest source (-1 if unreachable) and the
+    # parent of every cell on a shortest path (sources are their own parent);
+    # a linked cell is the cell id plus the closeOffsets entry of the link,
+    # ids are int32 throughout
+    cellCount = len(linkTable)
+    distances = np.full(cellCount, -1, dtype=np.int32)
+    parents = np.full(cellCount, -1, dtype=np.int32)
+
+    closeOffsets = np.asarray(closeOffsets, dtype=np.int32)
+    frontier = np.unique(np.asarray(list(sourceIds), dtype=np.int32))
+    distances[frontier] = 0
+    parents[frontier] = frontier
+
+    distance = 0
+    while len(frontier) and (goalId is None or distances[goalId] < 0):
+        distance += 1
+        rows, directions = np.nonzero(linkTable[frontier])
+        nextParents = frontier[rows]
+        nextIds = nextParents + closeOffsets[directions]
+        isNew = distances[nextIds] < 0
+        nextIds, nextParents = nextIds[isNew], nextParents[isNew]
+        distances[nextIds] = distance
+        parents[nextIds] = nextParents
+        frontier = np.unique(nextIds)
+
+    return distances, parents
+
+
+def getPathFromParents(parents: np.ndarray, goalId: int) -> Optional[List[int]]:
+    # cell ids from the source that reached goalId up to goalId
+    if parents[goalId] < 0:
+        return None
+    path = [int(goalId)]
+    while parents[path[-1]] != path[-1]:
+        path.append(int(parents[path[-1]]))
+    return list(reversed(path))
@@ -0,0 +1,121 @@
+from typing import Tuple
+import numpy as np
+
+# layout of one triangle in a binary stl file
+STL_RECORD = np.dtype(
+    [("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")]
+)
+STL_HEADER_SIZE = 84
+
+
+def getNormals(triangles: np.ndarray) -> np.ndarray:
+    normals = np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(lengths > 0, lengths, 1)
+
+
+def writeBinaryStl(
+    path: str,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    header: bytes = b"labyrinth cube",
+    chunkSize: int = 1 << 20,
+):
+    # faces index into vertices; large meshes are converted chunk by chunk so
+    # only chunkSize records are held in memory besides the indexed mesh
+    with open(path, "wb") as stl:
+        stl.write(header[:80].ljust(80, b" "))
+        stl.write(np.uint32(len(faces)).tobytes())
+        for start in range(0, len(faces), chunkSize):
+            triangles = vertices[faces[start : start + chunkSize]].astype(np.float32)
+            records = np.zeros(len(triangles), dtype=STL_RECORD)
+            records["normal"] = getNormals(triangles)
+            records["vertices"] = triangles
+            stl.write(records.tobytes())
+
+
+def writeTriangles(path: str, triangles: np.ndarray, header: bytes = b"labyrinth cube"):
+    # triangles of shape (F, 3, 3)
+    faces = np.arange(3 * len(triangles)).reshape(-1, 3)
+    writeBinaryStl(path, triangles.reshape(-1, 3), faces, header)
+
+
+def isBinaryStl(path: str) -> bool:
+    with open(path, "rb") as stl:
+        header = stl.read(STL_HEADER_SIZE)
+        stl.seek(0, 2)
+        fileSize = stl.tell()
+    if len(header) < STL_HEADER_SIZE:
+        return False
+    count = int(np.frombuffer(header[80:84], dtype="<u4")[0])
+    # ascii files start with "solid" too, but the size will not match
+    return fileSize == STL_HEADER_SIZE + count * STL_RECORD.itemsize
+
+
+def readBinaryStl(path: str) -> np.ndarray:
+    # memory mapped records, nothing is read until the fields are accessed
+    with open(path, "rb") as stl:
+        stl.seek(80)
+        count = int(np.frombuffer(stl.read(4), dtype="<u4")[0])
+    if count == 0:
+        return np.zeros(0, dtype=STL_RECORD)
+    return np.memmap(
+        path, dtype=STL_RECORD, mode="r", offset=STL_HEADER_SIZE, shape=(count,)
+    )
+
+
+def readAsciiStl(path: str) -> np.ndarray:
+    with open(path, "rb") as stl:
+        tokens = np.array(stl.read().split())
+    vertexTokens = np.flatnonzero(tokens == b"vertex")
+    coordinates = tokens[vertexTokens[:, None] + np.arange(1, 4)].astype(np.float32)
+    return coordinates.reshape(-1, 3, 3)
+
+
+def readTriangles(path: str) -> np.ndarray:
+    # (F, 3, 3) triangle corners of a binary or ascii stl file
+    if isBinaryStl(path):
+        return readBinaryStl(path)["vertices"]
+    return readAsciiStl(path)
+
+
+def getIndexedMesh(triangles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # merge identical corners into shared vertices; sorting the raw float32 bits
+    # is much faster than np.unique(axis=0) on millions of corners
+    corners = np.asarray(triangles, dtype=np.float32).reshape(-1, 3) + 0.0
+    bits = corners.view(np.uint32)
+    xyBits = (bits[:, 0].astype(np.uint64) << np.uint64(32)) | bits[:, 1]
+    order = np.lexsort((bits[:, 2], xyBits))
+    sortedBits = bits[order]
+    isFirst = np.ones(len(order), dtype=bool)
+    isFirst[1:] = np.any(sortedBits[1:] != sortedBits[:-1], axis=1)
+    faces = np.empty(len(order), dtype=np.int64)
+    faces[order] = np.cumsum(isFirst) - 1
+    return corners[order[isFirst]], faces.reshape(-1, 3)
+
+
+def convertToBinaryStl(path: str) -> bool:
+    # rewrites an ascii stl (as written by openscad) as binary stl in place
+    if isBinaryStl(path):
+        return False
+    writeBinaryStl(path, *getIndexedMesh(readAsciiStl(path)))
+    return True
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser("Convert .stl files to binary stl")
+    parser.add_argument("files", help=".stl files to convert in place", nargs="+")
+    args = parser.parse_args()
+
+    for path in args.files:
+        converted = convertToBinaryStl(path)
+        vertices, faces = getIndexedMesh(readTriangles(path))
+        print(
+            f"{path}: {'converted' if converted else 'already binary'}, "
+            f"{len(faces)} triangles, {len(vertices)} vertices"
+        )
@@ -0,0 +1,140 @@
+import os, json, struct
+from typing import List, Optional, Tuple
+import numpy as np
+
+# record header: magic, format version, generator version, generator name and
+# cube size; followed by the length and the json of the seed (any integer or
+# null) and the generator options (e.g. blockSize, index); then the packed
+# connection bits level by level
+MAZE_MAGIC = b"LABM"
+MAZE_FORMAT_VERSION = 1
+MAZE_HEADER = struct.Struct("<4sHH16sI")
+METADATA_LENGTH = struct.Struct("<H")
+
+
+def getLevelByteCount(cubeSize: int) -> int:
+    # every level (z) holds n * n * 3 bits and starts on a new byte
+    return -(-cubeSize * cubeSize * 3 // 8)
+
+
+def packConnections(connections: np.ndarray) -> bytes:
+    # levels first, so a level can be read without touching the others
+    levels = np.ascontiguousarray(np.moveaxis(connections, 2, 0))
+    return np.packbits(levels.reshape(len(levels), -1), axis=1).tobytes()
+
+
+class MazeRecord:
+    def __init__(self, data: np.ndarray, offset: int):
+        magic, formatVersion, generatorVersion, generator, cubeSize = (
+            MAZE_HEADER.unpack_from(data, offset)
+        )
+        if magic != MAZE_MAGIC:
+            raise ValueError(f"no maze record at offset {offset}")
+        if formatVersion != MAZE_FORMAT_VERSION:
+            raise ValueError(f"unsupported maze format version {formatVersion}")
+        self.formatVersion: int = formatVersion
+        self.generatorVersion: int = generatorVersion
+        self.generator: str = generator.rstrip(b"\0").decode()
+        self.cubeSize: int = cubeSize
+        self.offset = offset
+        (metadataLength,) = METADATA_LENGTH.unpack_from(data, offset + MAZE_HEADER.size)
+        metadataStart = offset + MAZE_HEADER.size + METADATA_LENGTH.size
+        metadata = json.loads(
+            bytes(data[metadataStart : metadataStart + metadataLength])
+        )
+        self.seed: Optional[int] = metadata["seed"]
+        self.options: dict = metadata["options"]
+        self.headerSize = MAZE_HEADER.size + METADATA_LENGTH.size + metadataLength
+        levelBytes = getLevelByteCount(cubeSize)
+        payload = data[offset + self.headerSize :]
+        self._levels = payload[: cubeSize * levelBytes].reshape(cubeSize, levelBytes)
+
+    @property
+    def size(self) -> int:
+        return self.headerSize + self._levels.size
+
+    @property
+    def shape(self) -> Tuple[int, int, int, int]:
+        return (self.cubeSize,) * 3 + (3,)
+
+    def __getitem__(self, index) -> np.ndarray:
+        # connections of a single cell (x, y, z) or a single flag (x, y, z, axis),
+        # indexed like the unpacked connections; LGraphNode reads records this way
+        x, y, z, *axis = (int(i) for i in index)
+        if axis:
+            return np.bool_(self.isConnected(x, y, z, axis[0]))
+        return np.array([self.isConnected(x, y, z, a) for a in range(3)])
+
+    def getLevelConnections(self, z: int) -> np.ndarray:
+        # (n, n, 3) connections of level z, only its bytes are read
+        n = self.cubeSize
+        bits = np.unpackbits(self._levels[z], count=n * n * 3)
+        return bits.reshape(n, n, 3).astype(bool)
+
+    def isConnected(self, x: int, y: int, z: int, axis: int) -> bool:
+        bit = (x * self.cubeSize + y) * 3 + axis
+        return bool(self._levels[z, bit // 8] >> (7 - bit % 8) & 1)
+
+    def getConnections(self) -> np.ndarray:
+        n = self.cubeSize
+        bits = np.unpackbits(self._levels, axis=1, count=n * n * 3)
+        return np.moveaxis(bits.reshape(n, n, n, 3), 0, 2).astype(bool)
+
+    def getGraph(self):
+        # the graph reads the packed levels of this record until an algorithm
+        # needs the whole cube
+        from labyrinth_graph import LabyrinthGraph
+
+        return LabyrinthGraph.fromRecord(self)
+
+
+class MazeFile:
+    # memory mapped file of one or more maze records
+    def __init__(self, path: str):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        self.records: List[MazeRecord] = []
+        offset = 0
+        while offset < len(self.data):
+            self.records.append(MazeRecord(self.data, offset))
+            offset += self.records[-1].size
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index: int) -> MazeRecord:
+        return self.records[index]
+
+
+def writeMaze(
+    path: str,
+    connections: np.ndarray,
+    seed: Optional[int] = None,
+    generator: str = "",
+    generatorVersion: int = 0,
+    append: bool = False,
+    options: Optional[dict] = None,
+):
+    # options: the generator options setRandomTree needs to repeat the maze
+    if seed is not None:
+        if isinstance(seed, bool) or not isinstance(seed, (int, np.integer)):
+            raise ValueError(f"maze seed must be an integer or None, not {seed!r}")
+        seed = int(seed)
+    metadata = {"seed": seed, "options": options or {}}
+    metadataJson = json.dumps(metadata, sort_keys=True).encode()
+    header = MAZE_HEADER.pack(
+        MAZE_MAGIC,
+        MAZE_FORMAT_VERSION,
+        generatorVersion,
+        generator.encode()[:16],
+        connections.shape[0],
+    )
+    header += METADATA_LENGTH.pack(len(metadataJson)) + metadataJson
+    with open(path, "ab" if append else "wb") as mazeFile:
+        mazeFile.write(header + packConnections(connections))
+
+
+def readMaze(path: str, index: int = 0) -> MazeRecord:
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    return MazeFile(path)[index]
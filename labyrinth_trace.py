@@ -0,0 +1,177 @@
+import json, os, resource, sys, threading, time, tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import List
+
+# returned by stage() while tracing is off, so untraced runs only pay one check
+NO_TRACE = nullcontext()
+
+
+def getPeakRss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.traceMemory = False
+        self.events: List[dict] = []
+        self.startTime = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self, traceMemory: bool = False):
+        # traceMemory measures the peak of every stage with tracemalloc, which
+        # slows python code down; tracemalloc has one peak for the process, so
+        # only stages of the main thread record it and stages of other threads
+        # (e.g. render workers) have no peak. Otherwise the growth of the
+        # process peak rss during the stage is recorded, which is 0 for stages
+        # that stay below the peak of an earlier stage
+        self.events = []
+        self.traceMemory = traceMemory
+        self.startTime = time.perf_counter()
+        if traceMemory:
+            tracemalloc.start()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        if self.traceMemory:
+            tracemalloc.stop()
+
+    def _getOpenStages(self) -> List[dict]:
+        if not hasattr(self._local, "stages"):
+            self._local.stages = []
+        return self._local.stages
+
+    @contextmanager
+    def stage(self, name: str, **args):
+        openStages = self._getOpenStages()
+        current = {"peak": 0}
+        tracePeak = self.traceMemory and threading.current_thread() is (
+            threading.main_thread()
+        )
+        if tracePeak:
+            # the enclosing stage keeps its own peak so far before the peak is
+            # reset for this stage
+            if openStages:
+                outer = openStages[-1]
+                outer["peak"] = max(outer["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        elif not self.traceMemory:
+            current["startRss"] = getPeakRss()
+        openStages.append(current)
+        startTime, startCpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wallTime = time.perf_counter() - startTime
+            cpuTime = time.thread_time() - startCpu
+            openStages.pop()
+            peak = None
+            if tracePeak:
+                peak = max(current["peak"], tracemalloc.get_traced_memory()[1])
+                if openStages:
+                    openStages[-1]["peak"] = max(openStages[-1]["peak"], peak)
+                tracemalloc.reset_peak()
+            elif not self.traceMemory:
+                peak = getPeakRss() - current["startRss"]
+            with self._lock:
+                self.events.append(
+                    {
+                        "name": name,
+                        "start": startTime - self.startTime,
+                        "wall": wallTime,
+                        "cpu": cpuTime,
+                        "peak": peak,
+                        "thread": threading.get_ident(),
+                        "depth": len(openStages),
+                        "args": args,
+                    }
+                )
+
+    def getChromeTrace(self) -> dict:
+        # trace event format, open with chrome://tracing or ui.perfetto.dev
+        pid = os.getpid()
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": event["name"],
+                    "cat": "labyrinth",
+                    "ph": "X",
+                    "ts": event["start"] * 1e6,
+                    "dur": event["wall"] * 1e6,
+                    "pid": pid,
+                    "tid": event["thread"],
+                    "args": {
+                        "cpu_ms": event["cpu"] * 1e3,
+                        **(
+                            {self.getMemoryKey(): event["peak"]}
+                            if event["peak"] is not None
+                            else {}
+                        ),
+                        **event["args"],
+                    },
+                }
+                for event in sorted(self.events, key=lambda e: e["start"])
+            ],
+        }
+
+    def getMemoryKey(self) -> str:
+        return "peak_bytes" if self.traceMemory else "rss_peak_growth_bytes"
+
+    def writeChromeTrace(self, path: str):
+        with open(path, "w") as traceFile:
+            json.dump(self.getChromeTrace(), traceFile)
+
+    def printSummary(self):
+        # totals per stage name, in the order the stages were first entered
+        stages = {}
+        for event in sorted(self.events, key=lambda e: e["start"]):
+            total = stages.setdefault(
+                event["name"],
+                {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak": None, "depth": 9},
+            )
+            total["calls"] += 1
+            total["wall"] += event["wall"]
+            total["cpu"] += event["cpu"]
+            if event["peak"] is not None:
+                total["peak"] = max(total["peak"] or 0, event["peak"])
+            total["depth"] = min(total["depth"], event["depth"])
+        memory = "traced peak" if self.traceMemory else "rss growth"
+        width = max([len(name) + 2 * t["depth"] for name, t in stages.items()] + [5])
+        print(
+            f"{'stage':<{width}} {'calls':>6} {'wall s':>9} {'cpu s':>9} {memory:>12}"
+        )
+        for name, total in stages.items():
+            label = "  " * total["depth"] + name
+            peak = "-" if total["peak"] is None else f"{total['peak'] / 1024**2:.1f}"
+            print(
+                f"{label:<{width}} {total['calls']:>6} {total['wall']:>9.3f} "
+                f"{total['cpu']:>9.3f} {peak:>8} MiB"
+            )
+
+
+TRACER = Tracer()
+
+
+def stage(name: str, **args):
+    # with stage("name", level=i): ... records the block while tracing is on
+    return TRACER.stage(name, **args) if TRACER.enabled else NO_TRACE
+
+
+def traced(name: str):
+    # decorator recording every call of a function as a stage
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
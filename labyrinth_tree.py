@@ -0,0 +1,159 @@
+from typing import List, Tuple
+import numpy as np
+
+from labyrinth_graph import LabyrinthGraph
+
+
+def getNeighborLists(indptr: np.ndarray, indices: np.ndarray) -> List[List[int]]:
+    # python lists of the adjacency from LabyrinthGraph.getAdjacency
+    bounds, ids = indptr.tolist(), indices.tolist()
+    return [ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def getTreeDistances(
+    neighbors: List[List[int]], sourceId: int
+) -> Tuple[List[int], List[int]]:
+    # distances and parents from a walk over the tree, cheaper than the layered
+    # numpy search of labyrinth_solver because a tree has few cells per layer
+    distances = [-1] * len(neighbors)
+    parents = [-1] * len(neighbors)
+    distances[sourceId], parents[sourceId] = 0, sourceId
+    stack = [sourceId]
+    while stack:
+        cellId = stack.pop()
+        for nextId in neighbors[cellId]:
+            if distances[nextId] < 0:
+                distances[nextId] = distances[cellId] + 1
+                parents[nextId] = cellId
+                stack.append(nextId)
+    return distances, parents
+
+
+class LabyrinthTree:
+    # index of a maze that is a spanning tree, rooted at the top corner node:
+    # parents, depths and binary lifting tables answer path queries between
+    # any two cells in O(log n), arrays of queries are answered at once
+    def __init__(self, lgraph: LabyrinthGraph):
+        self.lgraph = lgraph
+        self.rootId = lgraph.topCornerNode.cellId
+        depths, parents = getTreeDistances(
+            getNeighborLists(*lgraph.getAdjacency()), self.rootId
+        )
+        self.depths = np.array(depths, dtype=np.int32)
+        self.parents = np.array(parents, dtype=np.int32)
+        edgeCount = int(np.count_nonzero(lgraph.connections))
+        if np.any(self.depths < 0) or edgeCount != lgraph.cellCount - 1:
+            raise ValueError("the maze is not a spanning tree")
+
+        # ancestors[k][i] is the 2^k-th ancestor of cell i, the root is its
+        # own parent
+        ancestors = [self.parents]
+        for _ in range(max(int(self.depths.max()).bit_length() - 1, 0)):
+            ancestors.append(ancestors[-1][ancestors[-1]])
+        self.ancestors = np.stack(ancestors)
+
+    def getAncestors(self, cellIds, steps) -> np.ndarray:
+        # the ancestors steps levels above the cells, steps at most the depth
+        cellIds, steps = np.array(cellIds, dtype=np.int32), np.asarray(steps)
+        for k, ancestors in enumerate(self.ancestors):
+            move = (steps >> k) & 1 == 1
+            cellIds[move] = ancestors[cellIds[move]]
+        return cellIds
+
+    def getCommonAncestors(self, cellIds1, cellIds2) -> np.ndarray:
+        # lowest common ancestors, i.e. the cell of a path closest to the root
+        cellIds1, cellIds2 = np.asarray(cellIds1), np.asarray(cellIds2)
+        depths1, depths2 = self.depths[cellIds1], self.depths[cellIds2]
+        cellIds1 = self.getAncestors(cellIds1, np.maximum(depths1 - depths2, 0))
+        cellIds2 = self.getAncestors(cellIds2, np.maximum(depths2 - depths1, 0))
+        for ancestors in self.ancestors[::-1]:
+            ancestors1, ancestors2 = ancestors[cellIds1], ancestors[cellIds2]
+            differ = ancestors1 != ancestors2
+            cellIds1[differ], cellIds2[differ] = ancestors1[differ], ancestors2[differ]
+        return np.where(cellIds1 == cellIds2, cellIds1, self.parents[cellIds1])
+
+    def getPathLengths(self, cellIds1, cellIds2) -> np.ndarray:
+        # number of steps between the cells
+        commonIds = self.getCommonAncestors(cellIds1, cellIds2)
+        return (
+            self.depths[np.asarray(cellIds1)]
+            + self.depths[np.asarray(cellIds2)]
+            - 2 * self.depths[commonIds]
+        )
+
+    def getPath(self, startId: int, goalId: int) -> List[int]:
+        # cell ids from startId to goalId, both included
+        commonId = int(self.getCommonAncestors([startId], [goalId])[0])
+        up, down = [startId], [goalId]
+        while up[-1] != commonId:
+            up.append(int(self.parents[up[-1]]))
+        while down[-1] != commonId:
+            down.append(int(self.parents[down[-1]]))
+        return up + down[-2::-1]
+
+    def getPathLocations(self, startId: int, goalId: int) -> List[np.ndarray]:
+        # like LabyrinthGraph.findPath
+        return [self.lgraph.getCellLocation(i) for i in self.getPath(startId, goalId)]
+
+    def getCellIds(self, locations) -> np.ndarray:
+        # flat ids of an array of (x, y, z) locations
+        return np.asarray(locations) @ self.lgraph.cellStrides
+
+    def getFarthestPair(self) -> Tuple[int, int]:
+        # ends of a longest path (the diameter) of the maze
+        farthestId = int(np.argmax(self.depths))
+        lengths = self.getPathLengths(
+            np.full(self.lgraph.cellCount, farthestId), np.arange(self.lgraph.cellCount)
+        )
+        return farthestId, int(np.argmax(lengths))
+
+
+if __name__ == "__main__":
+
+    import time
+
+    rng = np.random.default_rng(0)
+    for cubeSize, generator in [
+        (1, "compat"),
+        (4, "compat"),
+        (9, "fast"),
+        (10, "eller"),
+    ]:
+        lgraph = LabyrinthGraph(cubeSize)
+        lgraph.setRandomTree(8, generator=generator)
+        ltree = LabyrinthTree(lgraph)
+        cellIds = rng.integers(lgraph.cellCount, size=(50, 2))
+        lengths = ltree.getPathLengths(cellIds[:, 0], cellIds[:, 1])
+        for (startId, goalId), length in zip(cellIds.tolist(), lengths.tolist()):
+            path = lgraph.findPath(
+                lgraph.getNodeById(startId), lgraph.getNodeById(goalId)
+            )
+            # findPath has no path from a room to itself
+            if startId == goalId:
+                assert path is None and length == 0
+                continue
+            assert length == len(path) - 1
+            locations = ltree.getPathLocations(startId, goalId)
+            assert all(np.array_equal(a, b) for a, b in zip(locations, path))
+    print("paths match findPath")
+
+    lgraph = LabyrinthGraph(50)
+    lgraph.setRandomTree(8, generator="fast")
+    start = time.perf_counter()
+    ltree = LabyrinthTree(lgraph)
+    buildTime = time.perf_counter() - start
+
+    queryCount = 100000
+    cellIds = rng.integers(lgraph.cellCount, size=(queryCount, 2))
+    start = time.perf_counter()
+    ltree.getPathLengths(cellIds[:, 0], cellIds[:, 1])
+    queryTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for startId, goalId in cellIds[:10].tolist():
+        lgraph.findPath(lgraph.getNodeById(startId), lgraph.getNodeById(goalId))
+    findTime = (time.perf_counter() - start) / 10
+    print(
+        f"cube size 50: index built in {buildTime:.3f} s, {queryCount} path lengths "
+        f"in {queryTime:.3f} s, findPath takes {findTime * 1000:.0f} ms per query"
+    )
@@ -0,0 +1,377 @@
+from typing import Dict, List, Tuple
+import numpy as np
+
+from labyrinth_level import LabyrinthLevel
+
+
+def getGridCenters(start: float, end: float, resolution: float) -> np.ndarray:
+    # centers of the voxels of edge length resolution that cover [start, end)
+    count = max(int(round((end - start) / resolution)), 1)
+    return start + (np.arange(count) + 0.5) * resolution
+
+
+def getSlabIds(edges: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    # slab under every voxel center, counted from 1, 0 outside of the slabs
+    ids = np.searchsorted(edges, centers, side="right")
+    ids[(centers < edges[0]) | (centers >= edges[-1])] = 0
+    return ids
+
+
+def sampleSlabMask(mask: np.ndarray, xIds: np.ndarray, yIds: np.ndarray):
+    # value of the (2n+1, 2n+1) slab cell under every voxel center
+    return np.pad(mask, ((1, 0), (1, 0)))[np.ix_(xIds, yIds)]
+
+
+def getSlabRunLengthMaps(mask: np.ndarray, ids: np.ndarray):
+    # run length maps along x and y of the square voxel grid sampled from a
+    # (2n+1, 2n+1) slab mask; voxel rows over the same slab row are equal, so
+    # the runs are measured on one voxel row per slab row: alongX[:, ids] and
+    # alongY[ids, :] are the maps of the whole grid
+    slabIds = np.arange(mask.shape[0] + 1)
+    alongX = getRunLengthMap(sampleSlabMask(mask, ids, slabIds), 0)
+    alongY = getRunLengthMap(sampleSlabMask(mask, slabIds, ids), 1)
+    return alongX, alongY
+
+
+def getRunLengthMap(mask: np.ndarray, axis: int) -> np.ndarray:
+    # for every True voxel the number of voxels of its run of True voxels
+    # along axis, 0 for False voxels
+    moved = np.moveaxis(mask, axis, -1)
+    rows = moved.reshape(-1, moved.shape[-1])
+    previous = np.pad(rows, ((0, 0), (1, 0)))[:, :-1]
+    runIds = np.cumsum(rows & ~previous).reshape(rows.shape)
+    lengths = np.bincount(runIds[rows], minlength=int(runIds.max()) + 1)
+    lengthMap = np.where(rows, lengths[runIds], 0).reshape(moved.shape)
+    return np.moveaxis(lengthMap, -1, axis)
+
+
+def getMinRunLength(mask: np.ndarray, axes) -> int:
+    # thinnest run of True voxels along any of the axes, 0 for an empty mask
+    if not mask.any():
+        return 0
+    lengths = []
+    for axis in axes:
+        rows = np.moveaxis(mask, axis, -1).reshape(-1, mask.shape[axis])
+        steps = np.diff(np.pad(rows, ((0, 0), (1, 1))).view(np.int8), axis=1)
+        starts, ends = np.flatnonzero(steps == 1), np.flatnonzero(steps == -1)
+        lengths.append(int((ends - starts).min()))
+    return min(lengths)
+
+
+def getRotationMatrix(rotation) -> np.ndarray:
+    # openscad rotate([a, b, c]) turns around x, then y, then z
+    a, b, c = np.radians(rotation)
+    rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    rz = np.array([[np.cos(c), -np.sin(c), 0], [np.sin(c), np.cos(c), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+def carveBoxes(isSolid: np.ndarray, centers, placements):
+    # removes the voxels whose centers lie in the rotated boxes of
+    # LabyrinthLevel.getWindowPlacements, only the voxels in the bounding box
+    # of a window are tested
+    for position, rotation, size in placements:
+        matrix = getRotationMatrix(rotation)
+        halfSize = np.asarray(size) / 2
+        reach = np.abs(matrix) @ halfSize
+        ranges = [
+            slice(
+                np.searchsorted(c, p - r, side="left"),
+                np.searchsorted(c, p + r, side="right"),
+            )
+            for c, p, r in zip(centers, position, reach)
+        ]
+        local = np.stack(
+            np.meshgrid(*[c[s] for c, s in zip(centers, ranges)], indexing="ij"),
+            axis=-1,
+        )
+        local = (local - position) @ matrix
+        isSolid[tuple(ranges)] &= ~np.all(np.abs(local) <= halfSize, axis=-1)
+
+
+def getWallVoxels(
+    level: LabyrinthLevel, side: int, resolution: float
+) -> Tuple[np.ndarray, int]:
+    # voxels of one outer wall slab (0: x = 0, 1: y = 0, 2: x max, 3: y max)
+    # with the windows cut out; returns the voxels and the axis across the wall
+    axis, isEnd = side % 2, side >= 2
+    size, thickness = level.levelSizeXY, level.wallThickness
+    wallStart = size - thickness if isEnd else 0
+    centers = [getGridCenters(0, size, resolution)] * 2
+    centers[axis] = getGridCenters(wallStart, wallStart + thickness, resolution)
+    centers.append(getGridCenters(0, level.levelSizeZ, resolution))
+    isSolid = np.ones(tuple(len(c) for c in centers), dtype=bool)
+    carveBoxes(isSolid, centers, level.getWindowPlacements())
+    return isSolid, axis
+
+
+def measureLevel(
+    level: LabyrinthLevel, resolution: float, minFloorWidth: float
+) -> Dict[str, float]:
+    # wall thickness and exposed floor of one level, in mm
+    pathLayer, floorLayer = level.getCarvedGrids()
+    centers = getGridCenters(0, level.levelSizeXY, resolution)
+    ids = getSlabIds(level.getSlabEdges(), centers)
+    sampledIds = np.unique(ids)
+    wallX, wallY = getSlabRunLengthMaps(~pathLayer, ids)
+    walls = np.concatenate([wallX[:, sampledIds].ravel(), wallY[sampledIds].ravel()])
+    floorX, floorY = getSlabRunLengthMaps(~floorLayer, ids)
+
+    # floor below the paths, it is only as thick as the floor layer
+    isExposed = sampleSlabMask(~floorLayer & pathLayer, ids, ids)
+    minVoxels = minFloorWidth / resolution
+    isThinFloor = isExposed & ((floorX < minVoxels)[:, ids] | (floorY < minVoxels)[ids])
+    zCenters = getGridCenters(0, level.levelSizeZ, resolution)
+    floorVoxels = int(np.count_nonzero(zCenters < level.floorThickness))
+
+    return {
+        "wallThickness": walls[walls > 0].min() * resolution,
+        "floorThickness": floorVoxels * resolution if isExposed.any() else np.inf,
+        "thinFloorArea": np.count_nonzero(isThinFloor) * resolution**2,
+    }
+
+
+def measureWindows(level: LabyrinthLevel, resolution: float) -> float:
+    # thinnest material left around the windows in the outer walls, in mm
+    thickness = np.inf
+    for side in range(4):
+        isSolid, axis = getWallVoxels(level, side, resolution)
+        inPlane = [a for a in range(3) if a != axis]
+        thickness = min(thickness, getMinRunLength(isSolid, inPlane) * resolution)
+    return thickness
+
+
+def measureCasingFit(lcase, resolution: float) -> Dict[str, float]:
+    # gaps between the casing cavity and the levels at their positions in
+    # the casing, along x and y from the footprint and along z from a column
+    level, spacing = lcase.lc.levels[0], lcase.lc.spacing
+    casingThickness, offset = lcase.casingThickness, lcase.cubeOffset
+    cavityEnd = casingThickness + level.levelSizeXY + 2 * lcase.tolerance
+
+    xy = getGridCenters(0, lcase.casingSize[0], resolution)
+    isCasing = (xy < casingThickness) | (xy >= cavityEnd)
+    isLevel = (xy >= offset[0]) & (xy < offset[0] + level.levelSizeXY)
+    isWall = isCasing[:, None] | isCasing[None, :]
+    isFootprint = isLevel[:, None] & isLevel[None, :]
+    isGap = ~isWall & ~isFootprint
+
+    wallTop = lcase.casingSize[2] + lcase.bonusHeight
+    z = getGridCenters(0, wallTop, resolution)
+    isSolid = [z < casingThickness] + [
+        (z >= start) & (z < start + level.levelSizeZ)
+        for start in offset[2] + spacing * np.arange(len(lcase.lc.levels))
+    ]
+    overlap = np.count_nonzero(np.sum(isSolid, axis=0) > 1)
+    gaps = getRunLengthMap(~np.any(isSolid, axis=0), 0)
+    # the run at the top is the headroom of the casing, not a gap between parts
+    gaps = gaps[: np.flatnonzero(np.any(isSolid, axis=0))[-1]]
+    gaps = gaps[gaps > 0]
+
+    # the levels stand at their positions in the casing, level k at
+    # offset + k * spacing, and the stack ends with the top of the last level
+    stackTop = offset[2] + spacing * (len(lcase.lc.levels) - 1) + level.levelSizeZ
+    return {
+        "clearanceXY": getMinRunLength(isGap, [0, 1]) * resolution,
+        "interferenceXY": np.count_nonzero(isWall & isFootprint) * resolution**2,
+        "clearanceZ": int(gaps.min()) * resolution if len(gaps) else 0.0,
+        "overlapZ": overlap * resolution,
+        "stackHeight": stackTop - casingThickness,
+        "cavityHeight": wallTop - casingThickness,
+    }
+
+
+def validateCube(
+    lcase,
+    resolution: float = 0.2,
+    minThickness: float = 0.8,
+    minFloorWidth: float = 2.0,
+    minClearance: float = 0.2,
+) -> dict:
+    # printability and fit of the levels of lcase.lc and the casing, measured
+    # on voxel grids with edge length resolution (mm), so every measurement
+    # is accurate to about one resolution
+    lcube = lcase.lc
+    levels: List[LabyrinthLevel] = lcube.levels
+    measurements = [measureLevel(l, resolution, minFloorWidth) for l in levels]
+    report = {
+        "resolution": resolution,
+        "wallThickness": min(m["wallThickness"] for m in measurements),
+        "floorThickness": min(m["floorThickness"] for m in measurements),
+        "thinFloorArea": sum(m["thinFloorArea"] for m in measurements),
+        "thinFloorLevels": [
+            k for k, m in enumerate(measurements) if m["thinFloorArea"] > 0
+        ],
+        # all levels have the same outer walls
+        "windowThickness": min(
+            [measureWindows(l, resolution) for l in levels[:1] if l.hasWindows]
+            + [np.inf]
+        ),
+        "levelGap": lcube.spacing - levels[0].levelSizeZ,
+        **measureCasingFit(lcase, resolution),
+    }
+
+    problems = []
+    for name, label in [
+        ("wallThickness", "walls"),
+        ("floorThickness", "floors"),
+        ("windowThickness", "material around the windows"),
+    ]:
+        if report[name] < minThickness:
+            problems.append(
+                f"{label} {report[name]:.2f} mm thick, below {minThickness} mm"
+            )
+    if report["interferenceXY"] > 0 or report["clearanceXY"] < minClearance:
+        problems.append(
+            f"levels have {report['clearanceXY']:.2f} mm clearance to the casing, "
+            f"below {minClearance} mm"
+        )
+    if report["overlapZ"] > 0:
+        problems.append(
+            f"levels overlap by {-report['levelGap']:.2f} mm, "
+            f"the spacing {lcube.spacing} mm is below the level height"
+        )
+    elif report["clearanceZ"] < minClearance:
+        problems.append(
+            f"levels have {report['clearanceZ']:.2f} mm vertical clearance, "
+            f"below {minClearance} mm"
+        )
+    if report["stackHeight"] > report["cavityHeight"]:
+        problems.append(
+            f"the spaced levels ({report['stackHeight']:.2f} mm) are higher than "
+            f"the casing walls ({report['cavityHeight']:.2f} mm)"
+        )
+    report["problems"] = problems
+
+    warnings = []
+    if report["thinFloorArea"] > 0:
+        warnings.append(
+            f"{report['thinFloorArea']:.0f} mm2 of floor narrower than "
+            f"{minFloorWidth} mm on levels {report['thinFloorLevels']}"
+        )
+    report["warnings"] = warnings
+    return report
+
+
+def printReport(report: dict):
+    for name in [
+        "wallThickness",
+        "floorThickness",
+        "windowThickness",
+        "thinFloorArea",
+        "clearanceXY",
+        "clearanceZ",
+        "levelGap",
+        "stackHeight",
+        "cavityHeight",
+    ]:
+        print(f"{name:<16} {report[name]:8.2f}")
+    for problem in report["problems"]:
+        print(f"problem: {problem}")
+    for warning in report["warnings"]:
+        print(f"warning: {warning}")
+
+
+if __name__ == "__main__":
+
+    import argparse, time
+    from labyrinth_config import LabyrinthConfig
+    from labyrinth_graph import LabyrinthGraph
+    from labyrinth_casing import LabyrinthCasing
+
+    parser = argparse.ArgumentParser("Check a Labyrinth Cube config for printability")
+    parser.add_argument("c", help="name of the config", nargs="?")
+    parser.add_argument(
+        "-s", dest="seed", help="seed instead of the one of the config", type=int
+    )
+    parser.add_argument(
+        "--resolution", help="voxel edge length in mm", dest="resolution", type=float
+    )
+    parser.add_argument(
+        "--min-thickness",
+        help="thinnest printable wall or floor in mm",
+        dest="min_thickness",
+        type=float,
+    )
+    parser.add_argument(
+        "--min-clearance",
+        help="smallest gap between levels and casing in mm",
+        dest="min_clearance",
+        type=float,
+    )
+    parser.add_argument(
+        "--check",
+        help="run the validator self-check instead of checking a config",
+        dest="check",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-windows",
+        help="levels without windows",
+        dest="windows",
+        action="store_false",
+    )
+    parser.set_defaults(seed=None)
+    parser.set_defaults(resolution=0.2)
+    parser.set_defaults(min_thickness=0.8)
+    parser.set_defaults(min_clearance=0.2)
+    parser.set_defaults(check=False)
+    parser.set_defaults(windows=True)
+
+    args = parser.parse_args()
+
+    def createCasing(config: dict, seed: int = None, windows: bool = True):
+        lgraph = LabyrinthGraph(config["cubeSize"])
+        lgraph.setRandomTree(config["seed"] if seed is None else seed)
+        lcube = lgraph.getLabyrinthCube(
+            config["levelWallThickness"],
+            config["levelPathThickness"],
+            config["levelSpacing"],
+        )
+        if windows:
+            lcube.addAllWindows()
+        return LabyrinthCasing(
+            lcube, config["casingWallThickness"], config["casingTolerance"]
+        )
+
+    def checkValidator():
+        assert not validateCube(createCasing(LabyrinthConfig.config01))["problems"]
+
+        # spacing below the level height: the levels overlap, and more than the
+        # headroom of the casing below it the stack is higher than the walls
+        config = dict(LabyrinthConfig.config01)
+        levelHeight = createCasing(config).lc.levels[0].levelSizeZ
+        config["levelSpacing"] = levelHeight - 4
+        report = validateCube(createCasing(config))
+        assert report["overlapZ"] > 0 and report["levelGap"] < 0
+        assert any("overlap" in p for p in report["problems"])
+        assert any("casing walls" in p for p in report["problems"])
+
+        # the 0.6 mm casing tolerance and 0.8 mm level gap below the clearance
+        report = validateCube(createCasing(LabyrinthConfig.config01), minClearance=1)
+        assert any("clearance to the casing" in p for p in report["problems"])
+        assert any("vertical clearance" in p for p in report["problems"])
+
+        # walls thinner than the printable minimum
+        config = {**LabyrinthConfig.config01, "levelWallThickness": 0.4}
+        report = validateCube(createCasing(config))
+        assert any(p.startswith("walls") for p in report["problems"])
+        print("validator check passed")
+
+    if args.check:
+        checkValidator()
+        exit(0)
+    if args.c is None:
+        parser.error("the name of a config or --check is required")
+
+    config = dict(getattr(LabyrinthConfig, args.c))
+    lcase = createCasing(config, args.seed, args.windows)
+
+    start = time.perf_counter()
+    report = validateCube(
+        lcase, args.resolution, args.min_thickness, minClearance=args.min_clearance
+    )
+    duration = time.perf_counter() - start
+    printReport(report)
+    print(f"validated in {duration:.3f} s")
+    exit(1 if report["problems"] else 0)
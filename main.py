@@ -1,16 +1,217 @@
-import argparse, os, json
+import argparse, os, json, time
+from typing import List
 import numpy as np
 
-from solid.solidpython import scad_render_to_file
-from labyrinth_casing import LabyrinthCasing
-from labyrinth_graph import LabyrinthGraph
+from labyrinth_graph import LabyrinthGraph, streamLabyrinthLevels
 from labyrinth_config import LabyrinthConfig
-from labyrinth_map import LabyrinthMap
-from subprocess import run
+from labyrinth_cache import ArtifactCache
+from labyrinth_trace import TRACER, stage
 
+# outputs that need the levels; solidpython and the geometry modules are only
+# imported for these, graph-only commands start without them
+GEOMETRY_OUTPUTS = ["stl", "vc", "vp", "map"]
 
-def exportStl(name: str):
-    run(["openscad", "-q", "--o", f"{name}.stl", f"{name}.scad"])
+
+def needs_cube(outputs: List[str]) -> bool:
+    return any(output in GEOMETRY_OUTPUTS for output in outputs)
+
+
+def exportStl(names: List[str], render_options: dict = None, keys: List[str] = None):
+    from labyrinth_render import renderAll, printSummary
+
+    start = time.perf_counter()
+    results = renderAll(names, keys=keys, **(render_options or {}))
+    printSummary(results, time.perf_counter() - start)
+    failed = [os.path.basename(r.name) for r in results if not r.success]
+    if failed:
+        raise RuntimeError(f"rendering failed for {', '.join(failed)}")
+
+
+def create_graph(config: dict, generator: str = "compat", **generator_options):
+    lgraph = LabyrinthGraph(config["cubeSize"])
+    lgraph.setRandomTree(config["seed"], generator=generator, **generator_options)
+    return lgraph
+
+
+def create_cube(lgraph: LabyrinthGraph, config: dict, windows: bool = True):
+    lcube = lgraph.getLabyrinthCube(
+        config["levelWallThickness"],
+        config["levelPathThickness"],
+        config["levelSpacing"],
+    )
+    if windows:
+        lcube.addAllWindows()
+    return lcube
+
+
+def create_level_stl(level, name: str, mesher: str = "openscad") -> bool:
+    # returns False if the level has to be rendered by openscad, which is the
+    # fallback for levels with windows
+    if mesher != "native":
+        return False
+    from labyrinth_mesh import canMeshLevel, createLevelStl
+
+    if canMeshLevel(level):
+        before, after = createLevelStl(level, name)
+        print(f"{os.path.basename(name)}: merged {before} into {after} triangles")
+        return True
+    return False
+
+
+def write_stl_sources(
+    lcube,
+    lcase,
+    config_name: str,
+    path: str,
+    mesher: str = "openscad",
+    scad_mode: str = "tree",
+):
+    # writes the .scad files of the casing and the levels, and the .stl files
+    # of natively meshed levels; returns the names of all parts and the names
+    # and cache keys of the parts openscad has to render
+    names = [os.path.join(path, f"casing_{config_name}")]
+    keys = [lcase.createScadFile(names[0])]
+    render_names, render_keys = list(names), list(keys)
+    for i, level in enumerate(lcube.levels):
+        with stage("level", index=i):
+            names.append(os.path.join(path, f"level{i}_{config_name}"))
+            keys.append(level.createScadFile(names[-1], scad_mode))
+            if not create_level_stl(level, names[-1], mesher):
+                render_names.append(names[-1])
+                render_keys.append(keys[-1])
+    return names, render_names, render_keys
+
+
+def create_outputs(
+    lgraph: LabyrinthGraph,
+    lcube,
+    config: dict,
+    config_name: str,
+    path: str,
+    outputs: List[str],
+    render_options: dict = None,
+    mesher: str = "openscad",
+    scad_mode: str = "tree",
+) -> List[str]:
+    # outputs: any of "stl", "vc", "vp", "map", "maze"; returns the written
+    # files, lcube may be None if there are no geometry outputs; failed
+    # renders raise a RuntimeError once all other outputs are written
+    files = []
+    render_error = None
+    if "stl" in outputs or "vc" in outputs:
+        from labyrinth_casing import LabyrinthCasing
+
+        lcase = LabyrinthCasing(
+            lcube, config["casingWallThickness"], config["casingTolerance"]
+        )
+
+    if "stl" in outputs:
+        # all .scad files are written before the parts are rendered concurrently
+        names, render_names, render_keys = write_stl_sources(
+            lcube, lcase, config_name, path, mesher, scad_mode
+        )
+        with stage("exportStl", parts=len(render_names)):
+            try:
+                exportStl(render_names, render_options, render_keys)
+            except RuntimeError as error:
+                render_error = error
+        files += [f"{name}.{ext}" for name in names for ext in ["scad", "stl"]]
+
+    if "vc" in outputs or "vp" in outputs:
+        from solid.solidpython import scad_render_to_file
+        from labyrinth_scad import writeLevelModules
+
+        # the visualizations instance the levels of one shared module file
+        modules_path = os.path.join(path, f"levels_{config_name}.scad")
+        with stage("writeLevelModules"):
+            writeLevelModules(lcube.levels, modules_path)
+        modules_header = f"use <{os.path.basename(modules_path)}>\n"
+        files.append(modules_path)
+
+    if "vc" in outputs:
+        lcube.spacing = config["levelSpacing"]
+        vis_output_path = os.path.join(path, "labyrinth_case_visualization.scad")
+        with stage("caseVisualization"):
+            scad_render_to_file(
+                lcase.getCubeInCasingSolid(instanced=True),
+                vis_output_path,
+                file_header=modules_header,
+            )
+        files.append(vis_output_path)
+
+    if "vp" in outputs:
+        solution = lgraph.findPath(lgraph.topCornerNode, lgraph.bottomCornerNode)
+        lcube.spacing = config["viewSpacing"]
+        vis_output_path = os.path.join(path, "labyrinth_path_visualization.scad")
+        with stage("pathVisualization"):
+            scad_render_to_file(
+                lcube.getCubeSolid(instanced=True) + lcube.getPathSolid(solution),
+                vis_output_path,
+                file_header=modules_header,
+            )
+        files.append(vis_output_path)
+
+    if "map" in outputs:
+        from labyrinth_map import LabyrinthMap
+
+        lmap = LabyrinthMap(lcube=lcube)
+        with stage("map"):
+            lmap.render_map(path)
+        files += [os.path.join(path, "map.png"), os.path.join(path, "map.svg")]
+
+    if "maze" in outputs:
+        maze_path = os.path.join(path, f"{config_name}.maze")
+        lgraph.save(maze_path)
+        files.append(maze_path)
+
+    if lcube is not None:
+        lcube.spacing = config["levelSpacing"]
+    if render_error is not None:
+        raise render_error
+    return files
+
+
+def stream_stl(
+    config: dict,
+    config_name: str,
+    path: str,
+    windows: bool = True,
+    render_options: dict = None,
+    mesher: str = "openscad",
+    scad_mode: str = "tree",
+) -> List[str]:
+    # the levels of the eller generator are written while the maze is
+    # generated, so only one level is held in memory
+    from labyrinth_casing import LabyrinthCasing
+    from labyrinth_cube import LabyrinthCube
+
+    names, keys = [], []
+    render_names, render_keys = [], []
+    for z, level in streamLabyrinthLevels(
+        config["cubeSize"],
+        config["seed"],
+        config["levelWallThickness"],
+        config["levelPathThickness"],
+        windows,
+    ):
+        with stage("level", index=z):
+            names.append(os.path.join(path, f"level{z}_{config_name}"))
+            keys.append(level.createScadFile(names[-1], scad_mode))
+            if not create_level_stl(level, names[-1], mesher):
+                render_names.append(names[-1])
+                render_keys.append(keys[-1])
+
+    # the casing only needs the measurements, which all levels share
+    lcube = LabyrinthCube([level] * config["cubeSize"], config["levelSpacing"])
+    lcase = LabyrinthCasing(
+        lcube, config["casingWallThickness"], config["casingTolerance"]
+    )
+    names.insert(0, os.path.join(path, f"casing_{config_name}"))
+    render_names.insert(0, names[0])
+    render_keys.insert(0, lcase.createScadFile(names[0]))
+    with stage("exportStl", parts=len(render_names)):
+        exportStl(render_names, render_options, render_keys)
+    return [f"{name}.{ext}" for name in names for ext in ["scad", "stl"]]
 
 
 def check_path(path_name: str) -> str:
@@ -83,12 +284,112 @@ if __name__ == "__main__":
         dest="map",
         action="store_true",
     )
+    parser.add_argument(
+        "--maze",
+        help="save the bit-packed maze to a .maze file",
+        dest="maze",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--generator",
+        help="maze generator, compat reproduces the mazes of earlier versions",
+        dest="generator",
+        choices=["compat", "fast", "parallel", "eller", "boruvka"],
+    )
+    parser.add_argument(
+        "--stream",
+        help="write the .stl files level by level while the maze is generated; "
+        "requires --generator eller and allows no output other than --stl",
+        dest="stream",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--block-size",
+        help="block edge length for the parallel generator",
+        dest="block_size",
+        type=str2int,
+    )
+    parser.add_argument(
+        "--processes",
+        help="number of processes for the parallel generator",
+        dest="processes",
+        type=str2int,
+    )
+    parser.add_argument(
+        "--render-jobs",
+        help="number of parts openscad renders at the same time",
+        dest="render_jobs",
+        type=str2int,
+    )
+    parser.add_argument(
+        "--render-timeout",
+        help="seconds after which an openscad render is aborted",
+        dest="render_timeout",
+        type=float,
+    )
+    parser.add_argument(
+        "--render-retries",
+        help="how often a failed openscad render is retried",
+        dest="render_retries",
+        type=str2int,
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory of a cache for rendered .stl files",
+        dest="cache",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="maximum size of the .stl cache in MB",
+        dest="cache_size",
+        type=float,
+    )
+    parser.add_argument(
+        "--mesher",
+        help="native writes the .stl of levels without windows directly",
+        dest="mesher",
+        choices=["openscad", "native"],
+    )
+    parser.add_argument(
+        "--scad",
+        help="data writes the levels as an openscad module with coordinate arrays, "
+        "outline as one polygon per carved layer",
+        dest="scad_mode",
+        choices=["tree", "data", "outline"],
+    )
+    parser.add_argument(
+        "--trace",
+        help="write a chrome trace of the stages to this .json file and print "
+        "a summary",
+        dest="trace",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        help="record the peak memory of every traced stage of the main thread "
+        "(slower)",
+        dest="trace_memory",
+        action="store_true",
+    )
     parser.set_defaults(path_vis=False)
     parser.set_defaults(case_vis=False)
     parser.set_defaults(stl=False)
     parser.set_defaults(random=False)
     parser.set_defaults(windows=True)
     parser.set_defaults(maps=False)
+    parser.set_defaults(maze=False)
+    parser.set_defaults(stream=False)
+    parser.set_defaults(generator="compat")
+    parser.set_defaults(block_size=32)
+    parser.set_defaults(processes=None)
+    parser.set_defaults(render_jobs=None)
+    parser.set_defaults(render_timeout=None)
+    parser.set_defaults(render_retries=1)
+    parser.set_defaults(cache=None)
+    parser.set_defaults(mesher="openscad")
+    parser.set_defaults(scad_mode="tree")
+    parser.set_defaults(cache_size=2048)
+    parser.set_defaults(trace=None)
+    parser.set_defaults(trace_memory=False)
 
     args = parser.parse_args()
 
@@ -105,46 +406,86 @@ if __name__ == "__main__":
 
     print("config = " + json.dumps(config, sort_keys=True, indent=4))
 
-    lgraph = LabyrinthGraph(config["cubeSize"])
-    lgraph.setRandomTree(config["seed"])
+    if args.trace:
+        TRACER.start(args.trace_memory)
 
-    lcube = lgraph.getLabyrinthCube(
-        config["levelWallThickness"],
-        config["levelPathThickness"],
-        config["levelSpacing"],
-    )
-    print(f"Level width: {lcube.levels[0].levelSizeXY} mm")
-    
-    if args.windows:
-        lcube.addAllWindows()
+    render_options = {
+        "maxWorkers": args.render_jobs,
+        "timeout": args.render_timeout,
+        "retries": args.render_retries,
+        "cache": None,
+    }
+    if args.cache:
+        cache_bytes = int(args.cache_size * 1024**2)
+        render_options["cache"] = ArtifactCache(args.cache, cache_bytes)
 
-    lcase = LabyrinthCasing(
-        lcube, config["casingWallThickness"], config["casingTolerance"]
-    )
-    path = lgraph.findPath(lgraph.topCornerNode, lgraph.bottomCornerNode)
+    outputs = [
+        output
+        for output, requested in [
+            ("stl", args.stl),
+            ("vc", args.case_vis),
+            ("vp", args.path_vis),
+            ("map", args.map),
+            ("maze", args.maze),
+        ]
+        if requested
+    ]
 
-    if args.stl:
-        name = os.path.join(args.p, f"casing_{config_name}")
-        lcase.createScadFile(name)
-        exportStl(name)
-        for i, level in enumerate(lcube.levels):
-            name = os.path.join(args.p, f"level{i}_{config_name}")
-            level.createScadFile(name)
-            exportStl(name)
+    render_error = None
+    if args.stream:
+        if args.generator != "eller" or outputs not in [[], ["stl"]]:
+            parser.error(
+                "--stream requires --generator eller and allows no output "
+                "other than --stl"
+            )
+        try:
+            stream_stl(
+                config,
+                config_name,
+                args.p,
+                args.windows,
+                render_options,
+                args.mesher,
+                args.scad_mode,
+            )
+        except RuntimeError as error:
+            render_error = error
+    else:
+        generator_options = {}
+        if args.generator == "parallel":
+            generator_options = {
+                "blockSize": args.block_size,
+                "processes": args.processes,
+            }
+        lgraph = create_graph(config, args.generator, **generator_options)
 
-    if args.case_vis:
-        lcube.spacing = config["levelSpacing"]
-        vis_output_path = os.path.join(args.p, "labyrinth_case_visualization.scad")
-        scad_render_to_file(lcase.getCubeInCasingSolid(), vis_output_path)
-    
-    if args.path_vis:
-        lcube.spacing = config["viewSpacing"]
-        vis_output_path = os.path.join(args.p, "labyrinth_path_visualization.scad")
-        scad_render_to_file(
-            lcube.getCubeSolid() + lcube.getPathSolid(path), vis_output_path
-        )
+        lcube = None
+        if needs_cube(outputs):
+            lcube = create_cube(lgraph, config, args.windows)
+            print(f"Level width: {lcube.levels[0].levelSizeXY} mm")
 
-    if args.map:
-        lmap = LabyrinthMap(lcube=lcube)
-        lmap.render_png(args.p)
-    
\ No newline at end of file
+        try:
+            create_outputs(
+                lgraph,
+                lcube,
+                config,
+                config_name,
+                args.p,
+                outputs,
+                render_options,
+                args.mesher,
+                args.scad_mode,
+            )
+        except RuntimeError as error:
+            render_error = error
+    if render_options["cache"] is not None:
+        render_options["cache"].printStats()
+
+    if args.trace:
+        TRACER.stop()
+        TRACER.writeChromeTrace(args.trace)
+        TRACER.printSummary()
+
+    if render_error is not None:
+        print(render_error)
+        exit(1)